@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Adapt the number of benchmarks that run parallelly on every machine.
+# The load and free memory of the machines are sampled in a background
+# thread (over ssh, so it goes through the master connection) and the
+# dispatcher calls adjust() from its own thread. When a machine runs
+# out of memory, the number of its slots is halved, when it is
+# overloaded, it gets one slot less. When all its slots are busy and
+# it has enough memory and idle cores, it gets one slot more.
+# The running benchmarks are never killed, when a machine gets
+# fewer slots, we just do not run new benchmarks on it for a while.
+
+import subprocess
+import Queue
+
+from common import err, dbg
+from configs import configs
+from log import satt_log
+from ssh import ssh_command
+from health import Prober
+
+# the numbers from /proc that we need, in one ssh call
+SAMPLE_CMD = 'cat /proc/loadavg; grep MemAvailable /proc/meminfo; nproc'
+
+def sample_load(machine):
+    """
+    Return (load, free memory in MB, number of cpus) of the machine
+    or None if we failed getting them
+    """
+    try:
+        p = subprocess.Popen(ssh_command(machine, [SAMPLE_CMD],
+                                         ['-o', 'BatchMode=yes',
+                                          '-o', 'ConnectTimeout=10']),
+                             stdout = subprocess.PIPE,
+                             stderr = subprocess.STDOUT)
+        out, _ = p.communicate()
+    except OSError as e:
+        dbg('Failed sampling load of {0}: {1}'.format(machine, e.strerror))
+        return None
+
+    if p.returncode != 0:
+        dbg('Failed sampling load of {0}: {1}'.format(machine, out.strip()))
+        return None
+
+    try:
+        lines = out.split('\n')
+        load = float(lines[0].split()[0])
+        # MemAvailable:   12345678 kB
+        mem = int(lines[1].split()[1]) / 1024
+        cpus = int(lines[2])
+    except (IndexError, ValueError):
+        dbg('Wrong output of sampling load of {0}: {1}'.format(machine, out))
+        return None
+
+    return (load, mem, cpus)
+
+class AdaptiveParallelism(object):
+    """ Set the number of slots of machines by their load """
+
+    # how often we sample the machines (seconds)
+    INTERVAL = 30
+
+    def __init__(self, tasks):
+        if not configs.has_key('ssh-cmd'):
+            err('Adaptive parallelism needs ssh-cmd to sample the machines')
+
+        try:
+            self._min = int(configs['min-parallel'])
+            self._max = int(configs['max-parallel'])
+            self._min_mem = int(configs['min-free-memory'])
+        except ValueError:
+            err('Invalid min-parallel, max-parallel or min-free-memory')
+
+        if self._min < 1:
+            err('min-parallel must be at least 1')
+
+        self._tasks = list(tasks)
+        self._samples = Queue.Queue()
+        self._sampler = None
+
+    def start(self):
+        self._sampler = Prober(self._tasks, AdaptiveParallelism.INTERVAL,
+                               self._samples, sample_load)
+        self._sampler.start()
+
+    def stop(self):
+        if self._sampler:
+            self._sampler.stop()
+
+    def _upperBound(self, cpus):
+        if self._max > 0:
+            return self._max
+
+        return cpus
+
+    def _newParallel(self, task, sample, running):
+        load, mem, cpus = sample
+        par = task.getParallel()
+
+        if mem < self._min_mem:
+            return max(self._min, par / 2)
+        elif load > cpus:
+            return max(self._min, par - 1)
+        elif running >= par and load < cpus - 1 and mem > 2 * self._min_mem:
+            return min(self._upperBound(cpus), par + 1)
+
+        # if the bounds changed, get into them
+        return max(self._min, min(self._upperBound(cpus), par))
+
+    def adjust(self, running):
+        """
+        Change the number of slots of machines that we got new
+        samples for. running is dictionary task -> number of
+        running benchmarks
+        """
+        while True:
+            try:
+                task, sample = self._samples.get_nowait()
+            except Queue.Empty:
+                return
+
+            if sample is None:
+                # the machine is down, that is what HealthMonitor is for
+                continue
+
+            dbg('{0}: load {1}, {2} MB free, {3} cpus'
+                .format(task.getMachine(), *sample))
+
+            par = self._newParallel(task, sample, running.get(task, 0))
+            if par != task.getParallel():
+                satt_log('{0}: running {1} benchmarks parallelly'
+                         ' (load {2}, {3} MB free)'
+                         .format(task.getMachine(), par,
+                                 sample[0], sample[1]))
+                task.setParallel(par)
@@ -31,7 +31,13 @@ import time
 allowed_keys = ['tool-dir', 'remote-dir', 'benchmarks', 'machines',
                 'ssh-user', 'ssh-cmd', 'cmd', 'sync', 'timeout',
                 'no-db', 'sync-cmd', 'year', 'params', 'exclude', 'note',
-                'tool-tag']
+                'tool-tag', 'schedule', 'ssh-master', 'batch-size', 'engine',
+                'max-attempts', 'retry-delay', 'health-interval',
+                'health-failures', 'adaptive-parallel', 'min-parallel',
+                'max-parallel', 'min-free-memory', 'local', 'local-cmd',
+                'memlimit', 'timeout-grace', 'speculate', 'speculate-after',
+                'socket', 'db-flush-results', 'db-flush-interval',
+                'db-queue-size', 'spool']
 
 def usage():
     sys.stderr.write(
@@ -43,14 +49,81 @@ Usage: satt [OPTS] [tool]
 
 OPTS can be:
     --machines=file.txt             File with machines
+    --local=N                       Run benchmarks on this computer (N parallelly,
+                                    0 is the number of cpus) instead of the machines.
+                                    Runs local-cmd (or cmd if it is not set) without
+                                    ssh, every benchmark with limits on cpu time
+                                    (timeout) and memory (memlimit) and the time and
+                                    memory are measured by satt (by cgroup v2 if it
+                                    is available)
     --benchmarks=dir/set_file       Directory with sets of benchmarks or set file(s)
     --no-sync                       Do not sync tool on remote machines
+    --batch-size=N                  Run up to N benchmarks from the same category
+                                    by one command ({benchmark} expands to the list
+                                    of benchmarks separated by space)
+    --engine=[poll/threads]         poll (default) reads the output of benchmarks and
+                                    reports the results in one loop, threads reads
+                                    in separate threads and reports in a worker
+                                    thread, so a slow database does not block reading
+    --journal=file                  Where to write the journal of the run (default is
+                                    the name of the log with .journal suffix)
+    --resume=journal                Continue the run that was interrupted. The benchmarks
+                                    that did not finish are taken from its journal.
+                                    With --submit, the journal must be one that the
+                                    daemon wrote (tool.run-id.journal)
+    --max-attempts=N                How many times to run a benchmark that failed
+                                    (without result) before reporting it as ERROR
+                                    (default 5)
+    --retry-delay=S                 Run failed benchmark again after S seconds, the delay
+                                    doubles with every attempt (default 10)
+    --health-interval=S             Check every S seconds that the machines answer,
+                                    the machine that does not answer is taken out
+                                    of rotation until it answers again (default 60,
+                                    0 turns the checks off)
+    --health-failures=N             Take machine out of rotation when N of its last
+                                    10 benchmarks failed (default 5, 0 turns it off).
+                                    Without the checks, it is used again after 5 minutes
+    --adaptive-parallel             Change the number of benchmarks running parallelly
+                                    on a machine by its load and free memory (sampled
+                                    every 30 seconds over ssh-cmd). The number from
+                                    the machines file is the initial value
+    --min-parallel=N                Run at least N benchmarks on a machine (default 1)
+    --max-parallel=N                Run at most N benchmarks on a machine (default is
+                                    the number of its cpus)
+    --min-free-memory=MB            Halve the number of benchmarks on a machine
+                                    that has less free memory (default 2048)
+    --speculate                     When there are no more benchmarks to run, run
+                                    a copy of benchmarks that run long on free slots
+                                    of other machines and take the result of the one
+                                    that finishes first
+    --speculate-after=S             Run copy of benchmarks that run at least S seconds
+                                    (default 60)
+    --daemon                        Take the machines and run benchmarks of runs that
+                                    are submitted by --submit. The runs share the
+                                    machines fairly, every run has its own run id,
+                                    journal and results (the engine is always poll
+                                    and there are no copies of benchmarks)
+    --submit                        Submit the run given by the other options
+                                    to the daemon and exit
+    --no-ssh-master                 Do not keep one ssh connection per machine for
+                                    the whole run (every command connects on its own)
     --sync=[yes/no]                 Whether to sync tool on remote machines
     --debug                         Enable debugging messages
     --no-db                         Do not store result to database
     --year=[year]                   Specify year (git tag i. e. master, svcomp15, ...)
     --save-new-task                 Create new tasks if they are not in database
     --ignore-duplicates             Ignore duplicate results for tasks
+    --db-flush-results=N            Store results to the db by N at once (default 100)
+    --db-flush-interval=S           Store the results at least every S seconds
+                                    (default 10). The results are stored also on
+                                    exit, they are lost only if satt gets killed
+    --db-queue-size=N               Results waiting for the db writer. If there are
+                                    more, no new benchmarks are started until the
+                                    writer stores them (default 1000)
+    --spool=FILE                    Do not connect to the db, append the results
+                                    to FILE. Store them later by: db-cli replay FILE.
+                                    If the db is unreachable, the results are stored
+                                    to tool.run-id.spool automatically
     --exclude=set1.set,set2.set,... Do not run these benchmark sets. Ignored when
                                     standalone .set file is given in --benchmarks
                                     (applies only on directories).
@@ -62,6 +135,10 @@ OPTS can be:
     --tool-tag=tag                  tag for the tool to filter it in database
     --skip-known-benchmarks=ID      skip benchmarks for which we already have result in
                                     the db (for tool with id ID)
+    --schedule=[default/longest-first]
+                                    in which order to run the benchmarks. longest-first
+                                    starts the benchmarks that took longest in the
+                                    previous runs of the tool (same name or tag) first
 These options can be specified in config file (except for 'debug' and 'no-db')
 
 Each tool is supposed to have its own directory with config files and
@@ -78,13 +155,30 @@ remote-dir    -- where will we work on remote machines
 cmd           -- command to run for each benchmark. This command is run as given
                  (on local computer), therfore to run a test on remote computer,
 		 the command will probably call ssh
-timeout       -- timeout for tests
+timeout       -- timeout for tests. If it is set, satt kills benchmarks that
+                 run longer than timeout + timeout-grace (e. g. when ssh hangs)
+                 and reports them as TIMEOUT (or ERROR if there was no output)
+timeout-grace -- seconds to wait after timeout (default 60)
+memlimit      -- memory limit for tests in MB (only with --local)
+local-cmd     -- command to run for each benchmark with --local
 sync-cmd      -- run this command before running tests to sync tool and benchmarks
                  on remote computers
+ssh-cmd       -- ssh binary. If it is set, satt opens one connection to every
+                 machine and {ssh-cmd} expands to ssh that reuses it. The sync
+                 scripts can use $SATT_SSH (or rsync, that uses $RSYNC_RSH)
+ssh-master    -- set to 'no' to not keep the connections
+socket        -- Unix socket of the daemon (default satt.sock in the directory
+                 with satt). Users of the group of the daemon can submit runs
 year          -- specify year of sv-comp. The benchmarks will be checked out to this tag
 
 There are two special variables {benchmark} (synonym {file}) and {machine}
 that will expand to current benchmark file and remote machine.
+{pidfile} expands to a file in /tmp on the machine. If the command writes
+its process group into it (run_benchmark --pidfile), satt kills the processes
+on the machine when it kills the benchmark (timeout, Ctrl-C, ...).
+With --batch-size, {benchmark} expands to more benchmarks and the command
+must print '=== BENCHMARK' and the name of the benchmark before the output
+of every benchmark. {benchmark-dirname} and {file-dirname} can not be used then.
 
 Command-line argument have higher priority. Tool defaults to 'symbiotic'
 
@@ -94,6 +188,16 @@ user=[user]
 password=[passwd]
 db=[database]
 
+To keep the results in a sqlite file instead (no server is needed), use:
+backend=sqlite
+file=[path]   (relative to database/, the tables are created when it is new)
+The years and rating_methods must be filled in as in MySQL, or copy them
+from MySQL by: db-cli export file. Results are copied back by: db-cli import file
+
+Database created from database/database.sql must be updated by the scripts
+in database/migrations: ./db-cli migrate (./db-cli explain shows whether
+the queries of satt use the indexes)
+
 Allowed keys in config file:
 """)
 
@@ -115,7 +219,17 @@ configs = {'sync':'yes', 'ssh-user':'', 'remote-dir':'',
            'year':'master', 'params':{'*':''}, 'exclude':'',
            'started_at' : time.strftime('%Y-%m-%d-%H-%S'), 'note':'',
            'save-new-tasks' : 'no', 'ignore-duplicates' : 'no',
-           'send-email' : 'yes', 'skip-known-benchmarks' : 'no'}
+           'send-email' : 'yes', 'skip-known-benchmarks' : 'no',
+           'schedule' : 'default', 'ssh-master' : 'yes',
+           'batch-size' : '1', 'engine' : 'poll',
+           'run-id' : str(int(time.time())), 'max-attempts' : '5',
+           'retry-delay' : '10', 'health-interval' : '60',
+           'health-failures' : '5', 'adaptive-parallel' : 'no',
+           'min-parallel' : '1', 'max-parallel' : '0',
+           'min-free-memory' : '2048', 'timeout-grace' : '60',
+           'speculate' : 'no', 'speculate-after' : '60',
+           'socket' : 'satt.sock', 'db-flush-results' : '100',
+           'db-flush-interval' : '10', 'db-queue-size' : '1000'}
 
 def params_from_string(pars, pard = None):
     " pars = params string, pard = params dictionary "
@@ -186,16 +300,29 @@ def parse_configs(path = 'symbiotic/config'):
 
     return configs
 
-def parse_command_line():
+def parse_command_line(argv = None):
     from common import err, dbg
 
+    if argv is None:
+        argv = sys.argv[1:]
+
     try:
-        opts, args = getopt.getopt(sys.argv[1:], '',
+        opts, args = getopt.getopt(argv, '',
                                   ['help', 'machines=', 'benchmarks=',
                                    'no-sync', 'no-db', 'sync=', 'debug',
                                    'year=', 'exclude=', 'params=', 'note=',
                                    'save-new-tasks', 'ignore-duplicates',
-                                   'no-email', 'tool-tag=', 'skip-known-benchmarks='])
+                                   'no-email', 'tool-tag=', 'skip-known-benchmarks=',
+                                   'schedule=', 'no-ssh-master', 'batch-size=',
+                                   'engine=', 'journal=', 'resume=',
+                                   'max-attempts=', 'retry-delay=',
+                                   'health-interval=', 'health-failures=',
+                                   'adaptive-parallel', 'min-parallel=',
+                                   'max-parallel=', 'min-free-memory=',
+                                   'local=', 'speculate', 'speculate-after=',
+                                   'daemon', 'submit', 'db-flush-results=',
+                                   'db-flush-interval=', 'db-queue-size=',
+                                   'spool='])
 
     except getopt.GetoptError as e:
         err('{0}'.format(str(e)))
@@ -206,10 +333,46 @@ def parse_command_line():
             sys.exit(1)
         elif opt == '--machines':
             configs['machines'] = arg
+        elif opt == '--local':
+            configs['local'] = arg
         elif opt == '--benchmarks':
             configs['benchmarks'] = arg
         elif opt == '--no-sync':
             configs['sync'] = 'no'
+        elif opt == '--journal':
+            configs['journal'] = arg
+        elif opt == '--resume':
+            configs['resume'] = arg
+        elif opt == '--max-attempts':
+            configs['max-attempts'] = arg
+        elif opt == '--retry-delay':
+            configs['retry-delay'] = arg
+        elif opt == '--health-interval':
+            configs['health-interval'] = arg
+        elif opt == '--health-failures':
+            configs['health-failures'] = arg
+        elif opt == '--adaptive-parallel':
+            configs['adaptive-parallel'] = 'yes'
+        elif opt == '--min-parallel':
+            configs['min-parallel'] = arg
+        elif opt == '--max-parallel':
+            configs['max-parallel'] = arg
+        elif opt == '--min-free-memory':
+            configs['min-free-memory'] = arg
+        elif opt == '--speculate':
+            configs['speculate'] = 'yes'
+        elif opt == '--speculate-after':
+            configs['speculate-after'] = arg
+        elif opt == '--daemon':
+            configs['daemon'] = 'yes'
+        elif opt == '--submit':
+            configs['submit'] = 'yes'
+        elif opt == '--engine':
+            configs['engine'] = arg
+        elif opt == '--batch-size':
+            configs['batch-size'] = arg
+        elif opt == '--no-ssh-master':
+            configs['ssh-master'] = 'no'
         elif opt == '--sync':
             configs['sync'] = arg
         elif opt == '--no-db':
@@ -218,6 +381,14 @@ def parse_command_line():
             configs['save-new-tasks'] = 'yes'
         elif opt == '--ignore-duplicates':
             configs['ignore-duplicates'] = 'yes'
+        elif opt == '--db-flush-results':
+            configs['db-flush-results'] = arg
+        elif opt == '--db-flush-interval':
+            configs['db-flush-interval'] = arg
+        elif opt == '--db-queue-size':
+            configs['db-queue-size'] = arg
+        elif opt == '--spool':
+            configs['spool'] = arg
         elif opt == '--debug':
             configs['debug'] = 'yes'
         elif opt == '--year':
@@ -233,6 +404,8 @@ def parse_command_line():
         # we got the result, but we don't want to run it at all
         elif opt == '--skip-known-benchmarks':
             configs['skip-known-benchmarks'] = arg
+        elif opt == '--schedule':
+            configs['schedule'] = arg
         elif opt == '--no-email':
             configs['send-email'] = 'no'
         elif opt == '--params':
@@ -0,0 +1,655 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Daemon mode. The daemon owns the machines (and the lock) and runs
+# benchmarks of runs that are submitted over a Unix socket by
+# 'satt --submit'. A submission is one line of JSON with the command line
+# of satt ({"args": [...]}), the daemon answers with one line of JSON
+# ({"ok": true, "run-id": ...} or {"ok": false, "error": ...}).
+#
+# Every run has its own configs, queue, reporter and journal. The code
+# of satt reads the global configs, so the dispatcher puts the configs
+# of the run into it before it does anything with the run's benchmarks
+# (see DaemonDispatcher._use). Free slots are given to the run that has
+# the fewest benchmarks running, so the runs share the machines fairly.
+#
+# Checking out the benchmarks, synchronizing the tool and looking for
+# the benchmarks takes a while, so it is done in a child process
+# (it needs the configs of the run and changes the working directory,
+# so it can not be a thread). The child writes the benchmarks it found
+# into a file and the dispatcher accepts the run when the child exits.
+# Only one run is prepared at a time, the others wait for it.
+
+import os
+import re
+import sys
+import copy
+import json
+import time
+import errno
+import signal
+import socket
+import tempfile
+
+from common import err, dbg, colored
+from configs import configs, parse_configs, parse_command_line
+from dispatcher import Dispatcher
+from reporter import BenchmarkReport, create_reporter
+from tasks import BenchmarkQueue, get_benchmarks, git_checkout
+from journal import Journal, load_journal
+from sync import do_sync
+from log import satt_log
+
+# the keys that belong to the daemon, runs can not change them
+DAEMON_KEYS = ['machines', 'ssh-cmd', 'ssh-user', 'ssh-master', 'local',
+               'engine', 'debug', 'socket', 'daemon']
+
+# the commands of the tool, they run by shell as the user of the daemon
+COMMAND_KEYS = ['cmd', 'sync-cmd', 'local-cmd']
+
+# what a submitted value expanded into a command can contain
+_SHELL_SAFE = re.compile(r'^[\w\s.,:=+/@%-]*$')
+
+def _check_tool(tool):
+    """ The tool must be one of the directories with tools in satt """
+    if not tool or '/' in tool or '..' in tool or\
+       not os.path.isfile('{0}/config'.format(tool)):
+        raise ValueError('Unknown tool: {0}'.format(tool))
+
+def _check_journal(tool, path):
+    """ Only the runs of the daemon (their journals) can be resumed """
+    if '/' in path or not path.startswith('{0}.'.format(tool)) or\
+       not path.endswith('.journal') or not os.path.isfile(path):
+        raise ValueError('Not a journal of a run of the daemon: {0}'
+                         .format(path))
+
+def _check_submitted(trusted):
+    """
+    Check the values that the submission changed and that are expanded
+    into the commands of the tool, they can not contain anything that
+    the shell would interpret (trusted are the configs of the tool)
+    """
+    cmds = ' '.join([configs.get(k, '') for k in COMMAND_KEYS])
+
+    for key, val in configs.items():
+        old = trusted.get(key)
+        if key == 'params':
+            vals = [v for k, v in val.items() if old.get(k) != v]
+        elif val != old and '{{{0}}}'.format(key) in cmds:
+            vals = [val]
+        else:
+            continue
+
+        for v in vals:
+            if not _SHELL_SAFE.match(v):
+                raise ValueError('Forbidden characters in {0}: {1}'
+                                 .format(key, v))
+
+class Run(object):
+    """ One submitted run """
+
+    def __init__(self, conf):
+        self.configs = conf
+        self.queue = BenchmarkQueue()
+        self.report = None
+        self.journal = None
+        self.done = 0
+        self.count = 0
+        # the benchmarks were taken from the journal of the run
+        self.resumed = False
+
+        # how to run its benchmarks (see Dispatcher._readRunConfigs)
+        self.batch_size = 1
+        self.max_attempts = 1
+        self.retry_delay = 0
+        self.time_limit = None
+
+    def getId(self):
+        return self.configs['run-id']
+
+    def getTool(self):
+        return self.configs['tool']
+
+class Preparation(object):
+    """ Submitted run that waits for its benchmarks """
+
+    def __init__(self, run, conn, user):
+        self.run = run
+        # the client waits for the answer
+        self.conn = conn
+        self.user = user
+        # the child that prepares the run and the file with its result
+        self.pid = None
+        self.path = None
+
+class RunsReporter(BenchmarkReport):
+    """ Pass everything to the reporter of the benchmark's run """
+
+    def __init__(self):
+        BenchmarkReport.__init__(self)
+        # the run that the dispatcher works with now
+        self.current = None
+
+    def report(self, msg, rb):
+        rb.run.report.report(msg, rb)
+
+    def done(self, rb):
+        return rb.run.report.done(rb)
+
+    def progress(self, progress):
+        self.current.report.progress(progress)
+
+class DaemonDispatcher(Dispatcher):
+    """ Dispatcher that runs benchmarks of more runs """
+
+    def __init__(self, tasks):
+        self._runs_report = RunsReporter()
+        Dispatcher.__init__(self, tasks, BenchmarkQueue(), self._runs_report)
+
+        # copies of the benchmarks are not supported here,
+        # there may be more runs that need the free slots
+        self._speculate = False
+
+        # configs of the daemon, runs start with them
+        self._base = copy.deepcopy(configs)
+        self._runs = []
+        # submissions that wait for preparing, the first one is prepared
+        self._pending = []
+        # runs whose results can not be stored, their benchmarks are killed
+        self._failed = []
+        self._current = None
+        self._last_run_id = 0
+
+        self._server = None
+
+    def _use(self, run):
+        """ Make the dispatcher work with the run """
+        if self._current is run:
+            return
+
+        if not self._current is None:
+            self._current.done = self._benchmarks_done
+
+        configs.clear()
+        configs.update(run.configs)
+
+        self._current = run
+        self._runs_report.current = run
+        self._queue = run.queue
+        self._journal = run.journal
+        self._benchmarks_done = run.done
+        self._benchmarks_count = run.count
+        self._batch_size = run.batch_size
+        self._max_attempts = run.max_attempts
+        self._retry_delay = run.retry_delay
+        self._time_limit = run.time_limit
+
+    def _timeLimit(self, bench):
+        return bench.run.time_limit
+
+    def _running_of(self, run):
+        return len([b for b in self._runningBenchmarks() if b.run is run])
+
+    def _runBenchmark(self, task):
+        # fair share - the runs with fewer running benchmarks go first
+        runs = [r for r in self._runs
+                if not r.queue.empty() and not r.report.backlogged()]
+        runs.sort(key = self._running_of)
+
+        for run in runs:
+            self._use(run)
+            bench = Dispatcher._runBenchmark(self, task)
+            if bench is None:
+                # its benchmarks wait for another try
+                continue
+
+            bench.run = run
+            if bench.isBatch():
+                for rb in bench.benchmarks:
+                    rb.run = run
+
+            return bench
+
+        return None
+
+    def _requeue(self, rb):
+        if not rb.run in self._runs:
+            return
+
+        self._use(rb.run)
+        Dispatcher._requeue(self, rb)
+
+    def _benchmarkDone(self, bench):
+        # the run failed, nobody would store the result
+        if not bench.run in self._runs:
+            return
+
+        self._use(bench.run)
+        try:
+            Dispatcher._benchmarkDone(self, bench)
+        # the writer of the run failed (err() exits), the other runs go on
+        except SystemExit:
+            self._failRun(bench.run)
+
+    def _benchmarkReported(self, bench, ok):
+        self._use(bench.run)
+        Dispatcher._benchmarkReported(self, bench, ok)
+
+        run = bench.run
+        if self._benchmarks_done >= self._benchmarks_count and\
+           not run in [b.run for b in self._runningBenchmarks()]:
+            self._finishRun(run)
+
+    def _finishRun(self, run):
+        if not run in self._runs:
+            return
+
+        satt_log('Run {0} of {1} finished'.format(run.getId(), run.getTool()))
+        run.report.flush()
+        run.report.summary()
+        # the daemon lives long, do not keep its writer and connections
+        run.report.close()
+        run.journal.close()
+        self._runs.remove(run)
+
+    def _failRun(self, run):
+        """ Stop the run whose results can not be stored """
+        if not run in self._runs:
+            return
+
+        satt_log(colored('WARN: Storing results of run {0} of {1} failed, '
+                         'stopping it (it can be continued by '
+                         'satt --submit --resume={2} {1})'
+                         .format(run.getId(), run.getTool(),
+                                 run.journal.path), 'red'))
+        self._runs.remove(run)
+        # we may be just reading the output of its benchmarks,
+        # they are killed later
+        self._failed.append(run)
+
+    def _dropFailed(self):
+        """ Kill the benchmarks of the failed runs """
+        for bench in list(self._runningBenchmarks()):
+            if bench.run in self._failed:
+                self._dropBenchmark(bench)
+                self._untwin(bench)
+
+        for run in self._failed:
+            run.report.close()
+            run.journal.close()
+        self._failed = []
+
+    def _has_work(self):
+        # we wait for submissions until we are stopped
+        return True
+
+    def _maintain(self):
+        self._acceptSubmissions()
+        self._checkPreparation()
+        self._dropFailed()
+        Dispatcher._maintain(self)
+
+    def _tickReport(self):
+        for run in list(self._runs):
+            try:
+                run.report.tick()
+            except SystemExit:
+                self._failRun(run)
+
+    def _flushReport(self):
+        for run in list(self._runs):
+            try:
+                run.report.flush()
+            except SystemExit:
+                self._failRun(run)
+
+    def _newRunId(self):
+        run_id = max(int(time.time()), self._last_run_id + 1)
+        self._last_run_id = run_id
+
+        return str(run_id)
+
+    def _detach(self):
+        """ Stop working with the current run, the configs are rewritten """
+        if not self._current is None:
+            self._current.done = self._benchmarks_done
+        self._current = None
+
+    def _createRun(self, args):
+        """ Create run from the command line of satt, return it """
+        self._detach()
+
+        configs.clear()
+        configs.update(copy.deepcopy(self._base))
+
+        # the same as satt does, the tool is known
+        # only from the command line
+        tool = parse_command_line(args)
+        _check_tool(tool)
+
+        configs.clear()
+        configs.update(copy.deepcopy(self._base))
+        parse_configs('{0}/config'.format(tool))
+        trusted = copy.deepcopy(configs)
+
+        parse_command_line(args)
+        _check_submitted(trusted)
+
+        for key in DAEMON_KEYS:
+            if self._base.has_key(key):
+                configs[key] = self._base[key]
+            elif configs.has_key(key):
+                configs.pop(key)
+
+        if not configs.has_key('benchmarks'):
+            raise ValueError('Need directory or files with benchmarks sets')
+
+        if configs.has_key('local') and configs.has_key('local-cmd'):
+            configs['cmd'] = configs['local-cmd']
+
+        queue = BenchmarkQueue()
+        done = 0
+        if configs.has_key('resume'):
+            # the journal gives the run-id and start of the run
+            _check_journal(tool, configs['resume'])
+            done = load_journal(configs['resume'], queue)
+            if queue.empty():
+                raise ValueError('No benchmarks left to run')
+
+            ids = [r.getId() for r in self._runs] +\
+                  [p.run.getId() for p in self._pending]
+            if configs['run-id'] in ids:
+                raise ValueError('Run {0} is running'.format(configs['run-id']))
+        else:
+            configs['run-id'] = self._newRunId()
+            configs['started_at'] = time.strftime('%Y-%m-%d-%H-%S')
+
+        # all runs share the benchmarks, so we can switch
+        # them to another year only when nothing else runs
+        year = [r.configs['year'] for r in self._runs] +\
+               [p.run.configs['year'] for p in self._pending]
+        if year and year[0] != configs['year']:
+            raise ValueError('Runs on year {0} are running'.format(year[0]))
+
+        # the values are checked here, so that a wrong one refuses the run
+        self._readRunConfigs()
+
+        run = Run(dict(configs))
+        run.resumed = configs.has_key('resume')
+        run.queue = queue
+        run.done = done
+        run.batch_size = self._batch_size
+        run.max_attempts = self._max_attempts
+        run.retry_delay = self._retry_delay
+        run.time_limit = self._time_limit
+
+        return run
+
+    def _prepareRun(self, run, path):
+        """ Find benchmarks of the run and write them to path (in the child) """
+        configs.clear()
+        configs.update(run.configs)
+
+        if not git_checkout(configs['benchmarks'], configs['year']):
+            raise ValueError('Failed checkout benchmarks to {0}'
+                             .format(configs['year']))
+
+        machines = [t.getMachine() for t in self._tasks]
+        if not configs.has_key('local'):
+            do_sync(self._tasks)
+
+        if not run.resumed:
+            get_benchmarks(configs['benchmarks'], run.queue)
+
+        # machines that failed synchronizing were removed from tasks
+        synced = [t.getMachine() for t in self._tasks]
+        res = {'benchmarks' : run.queue.getBenchmarks(),
+               'unsynced' : [m for m in machines if not m in synced]}
+
+        f = open(path, 'w')
+        f.write(json.dumps(res))
+        f.close()
+
+    def _startPreparation(self):
+        prep = self._pending[0]
+        fd, prep.path = tempfile.mkstemp(prefix = 'satt-run-')
+        os.close(fd)
+
+        # do not let the child write what we have buffered
+        sys.stdout.flush()
+        prep.pid = os.fork()
+        if prep.pid != 0:
+            return
+
+        ret = 1
+        try:
+            self._prepareRun(prep.run, prep.path)
+            ret = 0
+        except (ValueError, OSError, IOError) as e:
+            satt_log(colored('WARN: Failed preparing run {0}: {1}'
+                             .format(prep.run.getId(), e), 'red'))
+        # err() logged the reason
+        except SystemExit:
+            pass
+        finally:
+            sys.stdout.flush()
+            # the daemon's connections and atexit handlers are not ours
+            os._exit(ret)
+
+    def _finishPreparation(self, prep, status):
+        """ Create the reporter and journal of the prepared run """
+        run = prep.run
+        if not os.WIFEXITED(status) or os.WEXITSTATUS(status) != 0:
+            raise ValueError('Failed preparing the run (see the log of the daemon)')
+
+        f = open(prep.path, 'r')
+        res = json.loads(f.read())
+        f.close()
+
+        for m in res['unsynced']:
+            for task in [t for t in self._tasks if t.getMachine() == m]:
+                satt_log(colored('WARN: Removing machine {0}, synchronizing'
+                                 ' failed'.format(m), 'red'))
+                self._evictTask(task)
+                self._tasks.remove(task)
+
+        # the resumed run has its queue from the journal
+        if not run.resumed:
+            for name, cat in res['benchmarks']:
+                run.queue.add((str(name), str(cat)))
+
+        run.count = run.queue.getCount() + run.done
+        if not run.queue.getCount():
+            raise ValueError('No benchmarks queued for running')
+
+        self._detach()
+        configs.clear()
+        configs.update(run.configs)
+
+        run.report = create_reporter()
+
+        if run.resumed:
+            run.journal = Journal(run.configs['resume'])
+        else:
+            run.journal = Journal('{0}.{1}.journal'.format(run.getTool(),
+                                                           run.getId()))
+            run.journal.header()
+            for bench in run.queue.getBenchmarks():
+                run.journal.queued(bench)
+        run.report.onStored(run.journal.finished)
+
+    def _checkPreparation(self):
+        """ Accept the run that is prepared, start preparing the next one """
+        if not self._pending:
+            return
+
+        prep = self._pending[0]
+        if prep.pid is None:
+            self._startPreparation()
+            return
+
+        pid, status = os.waitpid(prep.pid, os.WNOHANG)
+        if pid == 0:
+            return
+
+        self._pending.pop(0)
+        try:
+            self._finishPreparation(prep, status)
+            self._runs.append(prep.run)
+            satt_log('Accepted run {0} of {1} ({2} benchmarks, {3} done, '
+                     'user {4})'.format(prep.run.getId(), prep.run.getTool(),
+                                        prep.run.count, prep.run.done,
+                                        prep.user))
+            reply = {'ok' : True, 'run-id' : prep.run.getId(),
+                     'benchmarks' : prep.run.count}
+        except (ValueError, OSError, IOError) as e:
+            satt_log(colored('WARN: Refused run {0}: {1}'
+                             .format(prep.run.getId(), e), 'red'))
+            reply = {'ok' : False, 'error' : str(e)}
+        except SystemExit:
+            reply = {'ok' : False, 'error' : 'see the log of the daemon'}
+        finally:
+            os.unlink(prep.path)
+
+        self._reply(prep.conn, reply)
+
+    def _stopPreparations(self):
+        for prep in self._pending:
+            if not prep.pid is None:
+                os.kill(prep.pid, signal.SIGTERM)
+                os.waitpid(prep.pid, 0)
+                os.unlink(prep.path)
+
+            self._reply(prep.conn, {'ok' : False,
+                                    'error' : 'The daemon is stopping'})
+        self._pending = []
+
+    def _handleSubmission(self, conn):
+        """ Read the submission, return the reply or None if it is prepared """
+        data = ''
+        while not data.endswith('\n'):
+            chunk = conn.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+
+        try:
+            sub = json.loads(data)
+            run = self._createRun([str(a) for a in sub['args']])
+        except (ValueError, KeyError, TypeError, OSError, IOError) as e:
+            satt_log(colored('WARN: Refused submission: {0}'.format(e), 'red'))
+            return {'ok' : False, 'error' : str(e)}
+        # err() exits (and logs the reason), we do not want
+        # the daemon to end because of a wrong submission
+        except SystemExit:
+            return {'ok' : False, 'error' : 'see the log of the daemon'}
+
+        satt_log('Preparing run {0} of {1}'.format(run.getId(), run.getTool()))
+        self._pending.append(Preparation(run, conn, sub.get('user')))
+
+        return None
+
+    def _reply(self, conn, reply):
+        try:
+            conn.sendall(json.dumps(reply) + '\n')
+        except socket.error as e:
+            satt_log(colored('WARN: Failed answering submission: {0}'
+                             .format(e), 'red'))
+        conn.close()
+
+    def _acceptSubmissions(self):
+        while True:
+            try:
+                conn, addr = self._server.accept()
+            except socket.error as e:
+                if e.errno in [errno.EAGAIN, errno.EINTR]:
+                    return
+                raise
+
+            conn.setblocking(True)
+            conn.settimeout(10)
+            try:
+                reply = self._handleSubmission(conn)
+            except socket.error as e:
+                satt_log(colored('WARN: Failed handling submission: {0}'
+                                 .format(e), 'red'))
+                conn.close()
+                continue
+
+            # the client gets the answer when the run is prepared
+            if not reply is None:
+                self._reply(conn, reply)
+
+    def run(self):
+        path = configs['socket']
+        if os.path.exists(path):
+            os.unlink(path)
+
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        # users of the group of the daemon can submit runs
+        os.chmod(path, 0o660)
+        self._server.listen(8)
+        self._server.setblocking(False)
+
+        satt_log('Waiting for runs on {0}'.format(path))
+
+        try:
+            Dispatcher.run(self)
+        finally:
+            self._stopPreparations()
+            self._server.close()
+            os.unlink(path)
+
+def submit(args):
+    """ Send the command line to the daemon, return the run id """
+    path = configs['socket']
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        s.sendall(json.dumps({'args' : args,
+                              'user' : os.getenv('USER')}) + '\n')
+
+        data = ''
+        while not data.endswith('\n'):
+            chunk = s.recv(4096)
+            if not chunk:
+                break
+            data += chunk
+    except socket.error as e:
+        err('Failed submitting to satt daemon on {0}: {1}'.format(path, e))
+
+    s.close()
+
+    try:
+        reply = json.loads(data)
+    except ValueError:
+        err('Wrong answer from satt daemon: {0}'.format(data))
+
+    if not reply['ok']:
+        err('The daemon refused the run: {0}'.format(reply['error']))
+
+    return reply['run-id']
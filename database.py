@@ -26,74 +26,426 @@
 #
 # On arran we have only python2, so use python2
 
-import MySQLdb
+import os
+import re
+import sqlite3
+import hashlib
 
 from common import err
 from os.path import abspath
 
+try:
+    import MySQLdb
+except ImportError:
+    # only the sqlite backend can be used
+    MySQLdb = None
+
+# can not connect to the server, server has gone away, lost connection
+CONNECTION_ERRORS = [2002, 2003, 2006, 2013]
+# the code of MySQL error for duplicate entries, we use it for sqlite too
+DUPLICATE_ENTRY = 1062
+
+class DatabaseUnreachable(Exception):
+    """ The server is down or we lost the connection to it """
+    pass
+
+def is_unreachable(args):
+    """ Is the error (args of the store's Error) a connection error? """
+    return len(args) > 0 and args[0] in CONNECTION_ERRORS
+
+class SqliteError(Exception):
+    """
+    Error of the sqlite store. The args are (code, message)
+    as of MySQLdb.Error, so that the handlers work with both stores
+    """
+    pass
+
+class MysqlStore(object):
+    """ The results are in a MySQL server (database/config) """
+
+    def __init__(self, conf):
+        if MySQLdb is None:
+            err('MySQLdb is not installed, use the sqlite backend '
+                '(backend=sqlite in database/config)')
+
+        self.Error = MySQLdb.Error
+        self._conf = conf
+
+    def connect(self, raise_unreachable):
+        host, user, passwd, db = self._conf['host'], self._conf['user'],\
+                                 self._conf['password'], self._conf['db']
+        check_db_credentials(host, user, passwd, db)
+
+        try:
+            conn = MySQLdb.connect(host = host, user = user,
+                                   passwd = passwd, db = db)
+            cursor = conn.cursor()
+        except MySQLdb.Error as e:
+            if raise_unreachable and is_unreachable(e.args):
+                raise DatabaseUnreachable(str(e))
+            err('{0}\n'.format(str(e)))
+
+        return conn, cursor
+
+    def upsert(self, cursor, table, cols, row, key):
+        # one round trip, LAST_INSERT_ID(id) makes lastrowid
+        # the id of the existing row
+        cursor.execute('INSERT INTO {0} ({1}) VALUES ({2}) '
+                       'ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id);'
+                       .format(table, ', '.join(cols),
+                               ', '.join(['%s'] * len(cols))), row)
+        return cursor.lastrowid
+
+    def accumulate(self, cursor, table, key, sums, rows):
+        # rows with a new key are inserted, for the others
+        # the values are added, all by one statement
+        cursor.executemany('INSERT INTO {0} ({1}) VALUES ({2}) '
+                           'ON DUPLICATE KEY UPDATE {3};'
+                           .format(table, ', '.join(key + sums),
+                                   ', '.join(['%s'] * len(key + sums)),
+                                   ', '.join(['{0} = {0} + VALUES({0})'
+                                              .format(c) for c in sums])),
+                           rows)
+
+def _sqlite_query(q, params):
+    # MySQLdb takes %s (only if there are parameters)
+    if params is None:
+        return q
+
+    # with parameters, % is written as %% (as for MySQLdb)
+    return re.sub('%[s%]', lambda m: '?' if m.group(0) == '%s' else '%', q)
+
+def _sqlite_error(e):
+    msg = str(e)
+    if isinstance(e, sqlite3.IntegrityError) and 'UNIQUE' in msg:
+        # the handlers look for this message (as from MySQL)
+        return SqliteError(DUPLICATE_ENTRY, 'Duplicate entry ({0})'.format(msg))
+
+    return SqliteError(0, msg)
+
+def _is_read(q):
+    return q.lstrip()[:7].upper() in ['SELECT ', 'EXPLAIN']
+
+class SqliteCursor(object):
+    """ Cursor that takes the queries written for MySQLdb """
+
+    def __init__(self, cursor, conn):
+        self._cursor = cursor
+        self._conn = conn
+
+    def execute(self, q, params = None):
+        try:
+            # reading does not start a transaction, we would not see
+            # what the other connections commit
+            if not _is_read(q):
+                self._conn.begin()
+
+            return self._cursor.execute(_sqlite_query(q, params),
+                                        params or ())
+        except sqlite3.Error as e:
+            raise _sqlite_error(e)
+
+    def executemany(self, q, rows):
+        """ All or none of the rows are stored as in MySQL """
+        try:
+            self._conn.begin()
+            self._cursor.execute('SAVEPOINT executemany')
+            try:
+                ret = self._cursor.executemany(_sqlite_query(q, rows), rows)
+            except sqlite3.Error:
+                self._cursor.execute('ROLLBACK TO executemany')
+                self._cursor.execute('RELEASE executemany')
+                raise
+
+            self._cursor.execute('RELEASE executemany')
+            return ret
+        except sqlite3.Error as e:
+            raise _sqlite_error(e)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+class SqliteConnection(object):
+    def __init__(self, conn):
+        # sqlite3 would commit before SAVEPOINT,
+        # we start and commit transactions ourselves
+        conn.isolation_level = None
+        self._conn = conn
+        self._in_transaction = False
+
+    def cursor(self):
+        return SqliteCursor(self._conn.cursor(), self)
+
+    def begin(self):
+        if not self._in_transaction:
+            self._conn.execute('BEGIN')
+            self._in_transaction = True
+
+    def commit(self):
+        if not self._in_transaction:
+            return
+
+        try:
+            self._conn.execute('COMMIT')
+            self._in_transaction = False
+        except sqlite3.Error as e:
+            raise _sqlite_error(e)
+
+    def close(self):
+        self._conn.close()
+
+class SqliteStore(object):
+    """
+    The results are in a sqlite file (file in database/config), so we do
+    not need a server. It has the same tables as database/database.sql,
+    they are created when the file is new (database/sqlite.sql)
+    """
+
+    SCHEMA = os.path.join(os.path.dirname(abspath(__file__)),
+                          'database', 'sqlite.sql')
+
+    def __init__(self, path):
+        self.Error = SqliteError
+        self._path = path
+
+    def connect(self, raise_unreachable):
+        try:
+            # the db writer uses the connection from its thread
+            conn = sqlite3.connect(self._path, timeout = 60,
+                                   check_same_thread = False)
+            # the tool outputs may be any bytes
+            conn.text_factory = str
+            conn.create_function('VERSION', 0,
+                                 lambda: 'SQLite {0}'.format(sqlite3.sqlite_version))
+            conn.create_function('SHA1', 1,
+                                 lambda s: hashlib.sha1(s).hexdigest())
+
+            # the readers do not block the writer (the reporter
+            # and the db writer have their own connections)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+
+            # new database, create the tables
+            if not conn.execute('SELECT name FROM sqlite_master '
+                                'WHERE name = \'years\';').fetchall():
+                f = open(self.SCHEMA, 'r')
+                conn.executescript(f.read())
+                f.close()
+        except sqlite3.Error as e:
+            err('Failed opening sqlite database {0}: {1}'.format(self._path, e))
+        except IOError as e:
+            err('Failed reading {0}: {1}'.format(self.SCHEMA, e.strerror))
+
+        conn = SqliteConnection(conn)
+        return conn, conn.cursor()
+
+    def upsert(self, cursor, table, cols, row, key):
+        cursor.execute('INSERT OR IGNORE INTO {0} ({1}) VALUES ({2});'
+                       .format(table, ', '.join(cols),
+                               ', '.join(['%s'] * len(cols))), row)
+        if cursor.rowcount == 1:
+            return cursor.lastrowid
+
+        # we have it already, sqlite is in this process,
+        # so the second query is cheap
+        cursor.execute('SELECT id FROM {0} WHERE {1};'
+                       .format(table, ' and '.join(['{0} = %s'.format(k)
+                                                    for k in key])),
+                       [row[cols.index(k)] for k in key])
+        return cursor.fetchall()[0][0]
+
+    def accumulate(self, cursor, table, key, sums, rows):
+        # only one connection writes at a time,
+        # so nobody inserts the row between the queries
+        update = 'UPDATE {0} SET {1} WHERE {2};'\
+                 .format(table, ', '.join(['{0} = {0} + %s'.format(c)
+                                           for c in sums]),
+                         ' and '.join(['{0} = %s'.format(k) for k in key]))
+        insert = 'INSERT INTO {0} ({1}) VALUES ({2});'\
+                 .format(table, ', '.join(key + sums),
+                         ', '.join(['%s'] * len(key + sums)))
+
+        for row in rows:
+            row = list(row)
+            cursor.execute(update, row[len(key):] + row[:len(key)])
+            if cursor.rowcount == 0:
+                cursor.execute(insert, row)
+
+def get_store(conffile = None):
+    """ Return the store given by database/config (or conffile) """
+    if conffile is None:
+        conffile = 'database/config'
+
+    conf = get_db_config(conffile)
+    backend = conf.get('backend', 'mysql')
+    if backend == 'mysql':
+        return MysqlStore(conf)
+    elif backend == 'sqlite':
+        if not conf.get('file'):
+            err('Missing \'file\' for sqlite database')
+
+        return SqliteStore(conf['file'])
+    else:
+        err('Unknown database backend: {0}'.format(backend))
+
 class DatabaseConnection(object):
-    def __init__(self, conffile = None):
-        self._conn, self._cursor = database_connect(conffile)
+    def __init__(self, conffile = None, raise_unreachable = False, store = None):
+        """
+        With raise_unreachable, connection errors raise DatabaseUnreachable
+        instead of exiting, so that the caller can store the results
+        elsewhere
+        """
+        self._raise_unreachable = raise_unreachable
+        if store is None:
+            store = get_store(conffile)
+
+        self._store = store
+        self._conn, self._cursor = store.connect(raise_unreachable)
 
     def __del__(self):
-        self._conn.close()
+        # the connection may have failed
+        if hasattr(self, '_conn'):
+            self._conn.close()
         del self
 
-    def query_unchecked(self, q):
-        self._cursor.execute(q)
+    def backend(self):
+        return self._store
+
+    def close(self):
+        """ Close the connection, what was not commited is rolled back """
+        self._conn.close()
+        del self._conn
+
+    def query_unchecked(self, q, params = None):
+        self._cursor.execute(q, params)
         return self._cursor.fetchall()
 
-    def query(self, q):
+    def _unreachable(self, e):
+        if self._raise_unreachable and is_unreachable(e.args):
+            raise DatabaseUnreachable(e.args[1])
+
+    def query(self, q, params = None):
+        """
+        Run q and return the rows. The values are passed in params
+        (%s in q), they are never formatted into the query
+        """
         try:
-            return self.query_unchecked(q)
-        except MySQLdb.Error as e:
+            return self.query_unchecked(q, params)
+        except self._store.Error as e:
+            self._unreachable(e)
             err('Failed querying db: {0}\n\n{1}'.format(e.args[1], q))
 
-    def query_with_exception_handler(self, q, handler, data):
+    def execute(self, q, params = None):
+        """ Run statement q (with %s placeholders), return the number of rows """
         try:
-            return self.query_unchecked(q)
-        except MySQLdb.Error as e:
+            self._cursor.execute(q, params)
+            return self._cursor.rowcount
+        except self._store.Error as e:
+            self._unreachable(e)
+            err('Failed querying db: {0}\n\n{1}'.format(e.args[1], q))
+
+    def query_with_exception_handler(self, q, handler, data, params = None):
+        try:
+            return self.query_unchecked(q, params)
+        except self._store.Error as e:
             handler(e.args, data)
 
+    def executemany_with_exception_handler(self, q, rows, handler, data):
+        """
+        Run q (with %s placeholders) for every row. Insert is done
+        by one statement with all the rows
+        """
+        try:
+            self._cursor.executemany(q, rows)
+        except self._store.Error as e:
+            handler(e.args, data)
+
+    def upsert(self, table, cols, row, key):
+        """
+        Insert the row if there is no row with the same unique key
+        (the key columns), return the id of the (new or existing) row
+        """
+        try:
+            return self._store.upsert(self._cursor, table, cols, row, key)
+        except self._store.Error as e:
+            self._unreachable(e)
+            err('Failed inserting into {0}: {1}'.format(table, e.args[1]))
+
+    def accumulate(self, table, key, sums, rows):
+        """
+        Add the values of sums columns of rows (key + sums values)
+        to the rows of the table with the same key, insert rows
+        with new keys
+        """
+        try:
+            self._store.accumulate(self._cursor, table, key, sums, rows)
+        except self._store.Error as e:
+            self._unreachable(e)
+            err('Failed updating {0}: {1}'.format(table, e.args[1]))
+
+    def executemany(self, q, rows):
+        try:
+            self._cursor.executemany(q, rows)
+        except self._store.Error as e:
+            self._unreachable(e)
+            err('Failed querying db: {0}\n\n{1}'.format(e.args[1], q))
+
     def commit(self):
-        self._conn.commit()
+        try:
+            self._conn.commit()
+        except self._store.Error as e:
+            self._unreachable(e)
+            err('Failed commiting to db: {0}'.format(e.args[1]))
 
+DB_CONFIG_KEYS = ['host', 'user', 'password', 'db', 'backend', 'file']
 
-def get_db_credentials(path = 'database/config'):
+def get_db_config(path = 'database/config'):
+    """ Return dictionary with the keys from database/config """
     absp = abspath(path)
     try:
         f = open(absp, 'r')
     except IOError as e:
         err("Failed opening file with database configuration: {0}".format(e.strerror))
 
-    host = None
-    user = None
-    db = None
-    pw = None
+    conf = dict()
 
     for l in f:
         l = l.lstrip()
-        if l[0] == '#':
+        if not l or l[0] == '#':
             continue
 
         k,v = l.split('=', 1)
         k = k.strip()
         v = v.strip()
 
-        if k == 'host':
-            host = v
-        elif k == 'user':
-            user = v
-        elif k == 'password':
-            pw = v
-        elif k == 'db':
-            db = v
+        if k in DB_CONFIG_KEYS:
+            conf[k] = v
         else:
             err('Unknown key in {0}: \'{1}\''.format(absp, k))
 
     f.close()
 
-    return host, user, pw, db
+    # the file is relative to the directory with the config
+    if conf.has_key('file'):
+        conf['file'] = os.path.join(os.path.dirname(absp),
+                                    os.path.expanduser(conf['file']))
+
+    return conf
+
+def get_db_credentials(path = 'database/config'):
+    conf = get_db_config(path)
+
+    return conf.get('host'), conf.get('user'), conf.get('password'),\
+           conf.get('db')
 
 def check_db_credentials(host, user, passwd, db):
     if host is None or host == '':
@@ -104,20 +456,3 @@ def check_db_credentials(host, user, passwd, db):
         err('Missing \'password\' for database')
     if db is None or db == '':
         err('Missing \'database\' for database')
-
-def database_connect(conffile = None):
-    if conffile:
-        host, user, passwd, db = get_db_credentials(conffile)
-    else:
-        host, user, passwd, db = get_db_credentials()
-
-    check_db_credentials(host, user, passwd, db)
-
-    try:
-        conn = MySQLdb.connect(host = host, user = user,
-                               passwd = passwd, db = db)
-        cursor = conn.cursor()
-    except MySQLdb.Error as e:
-        err('{0}\n'.format(str(e)))
-
-    return conn, cursor
@@ -0,0 +1,17 @@
+-- Unique keys that satt inserts tools and categories against
+-- (resolver.py), so that it gets the id of a new or existing row
+-- by one query. The tools are identified by name, version, params
+-- and year, that is too long for a key, so the key is on their hash
+-- (computed in the same way as resolver.tool_fingerprint).
+--
+-- Duplicate categories (the same name in one year) must be removed
+-- before running it. Duplicate tools keep NULL fingerprint.
+
+ALTER TABLE `tools` ADD COLUMN `fingerprint` char(40) DEFAULT NULL,
+  ADD UNIQUE KEY `uc_fingerprint` (`fingerprint`);
+
+UPDATE IGNORE `tools` SET `fingerprint` =
+  SHA1(CONCAT_WS(CHAR(31), IFNULL(`name`, ''), IFNULL(`version`, ''),
+                 IFNULL(`params`, ''), IFNULL(`year_id`, '')));
+
+ALTER TABLE `categories` ADD UNIQUE KEY `uc_yearName` (`year_id`, `name`);
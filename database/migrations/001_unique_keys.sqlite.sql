@@ -0,0 +1,13 @@
+-- The same as 001_unique_keys.sql for sqlite files created
+-- before the keys were in sqlite.sql. SHA1() is the function
+-- that satt registers in its connections.
+
+ALTER TABLE `tools` ADD COLUMN `fingerprint` char(40) DEFAULT NULL;
+
+CREATE UNIQUE INDEX `uc_fingerprint` ON `tools` (`fingerprint`);
+
+UPDATE OR IGNORE `tools` SET `fingerprint` =
+  SHA1(IFNULL(`name`, '') || char(31) || IFNULL(`version`, '') || char(31) ||
+       IFNULL(`params`, '') || char(31) || IFNULL(`year_id`, ''));
+
+CREATE UNIQUE INDEX `uc_yearName` ON `categories` (`year_id`, `name`);
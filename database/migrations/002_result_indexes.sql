@@ -0,0 +1,9 @@
+-- Indexes for the queries over many results (see ./db-cli explain).
+-- The results of a run (e-mail after the run) are found by run_id,
+-- the comparison of two tools (showdiff) reads the results of a tool
+-- ordered by task from the index only.
+
+ALTER TABLE `task_results`
+  ADD KEY `index_task_results_on_run_id` (`run_id`, `tool_id`),
+  ADD KEY `index_task_results_on_tool_task_result`
+      (`tool_id`, `task_id`, `result`);
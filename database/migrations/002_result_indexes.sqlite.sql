@@ -0,0 +1,7 @@
+-- The same as 002_result_indexes.sql
+
+CREATE INDEX IF NOT EXISTS `index_task_results_on_run_id`
+  ON `task_results` (`run_id`, `tool_id`);
+
+CREATE INDEX IF NOT EXISTS `index_task_results_on_tool_task_result`
+  ON `task_results` (`tool_id`, `task_id`, `result`);
@@ -0,0 +1,36 @@
+-- Summaries of results by run, tool, category, result, correctness
+-- and witness (summaries.py), the db writer updates them with every
+-- batch of results. The existing results are summarized here.
+
+CREATE TABLE `run_summaries` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `run_id` varchar(15) COLLATE utf8_unicode_ci DEFAULT NULL,
+  `tool_id` int(11) DEFAULT NULL,
+  `category_id` int(11) DEFAULT NULL,
+  `result` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL,
+  `is_correct` tinyint(1) DEFAULT NULL,
+  `witness` varchar(255) COLLATE utf8_unicode_ci DEFAULT NULL,
+  `num_results` int(11) NOT NULL DEFAULT '0',
+  `points` float NOT NULL DEFAULT '0',
+  `cpu_time` float NOT NULL DEFAULT '0',
+  `memory_usage` float NOT NULL DEFAULT '0',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uc_runSummary` (`run_id`, `tool_id`, `category_id`,
+                              `result`, `is_correct`, `witness`),
+  KEY `index_run_summaries_on_tool_id` (`tool_id`, `category_id`),
+  KEY `index_run_summaries_on_category_id` (`category_id`),
+  CONSTRAINT `run_summaries_ibfk_1` FOREIGN KEY (`tool_id`)
+    REFERENCES `tools` (`id`) ON DELETE CASCADE,
+  CONSTRAINT `run_summaries_ibfk_2` FOREIGN KEY (`category_id`)
+    REFERENCES `categories` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+
+INSERT INTO `run_summaries`
+  (`run_id`, `tool_id`, `category_id`, `result`, `is_correct`, `witness`,
+   `num_results`, `points`, `cpu_time`, `memory_usage`)
+  SELECT `run_id`, `tool_id`, `category_id`, `result`, `is_correct`,
+         `witness`, count(*), IFNULL(SUM(`points`), 0),
+         IFNULL(SUM(`cpu_time`), 0), IFNULL(SUM(`memory_usage`), 0)
+  FROM `task_results` INNER JOIN `tasks` ON `task_id` = `tasks`.`id`
+  GROUP BY `run_id`, `tool_id`, `category_id`, `result`, `is_correct`,
+           `witness`;
@@ -0,0 +1,33 @@
+-- The same as 003_run_summaries.sql
+
+CREATE TABLE IF NOT EXISTS `run_summaries` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `run_id` varchar(15) DEFAULT NULL,
+  `tool_id` int(11) DEFAULT NULL REFERENCES `tools` (`id`) ON DELETE CASCADE,
+  `category_id` int(11) DEFAULT NULL REFERENCES `categories` (`id`),
+  `result` varchar(255) DEFAULT NULL,
+  `is_correct` tinyint(1) DEFAULT NULL,
+  `witness` varchar(255) DEFAULT NULL,
+  `num_results` int(11) NOT NULL DEFAULT '0',
+  `points` float NOT NULL DEFAULT '0',
+  `cpu_time` float NOT NULL DEFAULT '0',
+  `memory_usage` float NOT NULL DEFAULT '0',
+  UNIQUE (`run_id`, `tool_id`, `category_id`, `result`, `is_correct`,
+          `witness`)
+);
+
+CREATE INDEX IF NOT EXISTS `index_run_summaries_on_tool_id`
+  ON `run_summaries` (`tool_id`, `category_id`);
+
+CREATE INDEX IF NOT EXISTS `index_run_summaries_on_category_id`
+  ON `run_summaries` (`category_id`);
+
+INSERT INTO `run_summaries`
+  (`run_id`, `tool_id`, `category_id`, `result`, `is_correct`, `witness`,
+   `num_results`, `points`, `cpu_time`, `memory_usage`)
+  SELECT `run_id`, `tool_id`, `category_id`, `result`, `is_correct`,
+         `witness`, count(*), IFNULL(SUM(`points`), 0),
+         IFNULL(SUM(`cpu_time`), 0), IFNULL(SUM(`memory_usage`), 0)
+  FROM `task_results` INNER JOIN `tasks` ON `task_id` = `tasks`.`id`
+  GROUP BY `run_id`, `tool_id`, `category_id`, `result`, `is_correct`,
+           `witness`;
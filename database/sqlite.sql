@@ -0,0 +1,121 @@
+-- Schema of the sqlite database (backend=sqlite in database/config).
+-- The tables are the same as in database.sql with the changes from
+-- database/migrations, the file is run when the database is created.
+
+CREATE TABLE IF NOT EXISTS `years` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `year` varchar(255) DEFAULT NULL UNIQUE,
+  `created_at` datetime DEFAULT NULL,
+  `updated_at` datetime DEFAULT NULL,
+  `svn_revision` int(11) NOT NULL DEFAULT '0'
+);
+
+CREATE TABLE IF NOT EXISTS `rating_methods` (
+  `year_id` int(11) NOT NULL PRIMARY KEY REFERENCES `years` (`id`),
+  `unknown` int(11) NOT NULL,
+  `false_correct` int(11) NOT NULL,
+  `false_incorrect` int(11) NOT NULL,
+  `true_correct` int(11) NOT NULL,
+  `true_incorrect` int(11) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS `metacategories` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` varchar(255) NOT NULL,
+  `year_id` int(11) NOT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS `categories` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` varchar(255) DEFAULT NULL,
+  `year_id` int(11) DEFAULT NULL REFERENCES `years` (`id`),
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `metacategory_id` int(11) DEFAULT NULL REFERENCES `metacategories` (`id`)
+);
+CREATE INDEX IF NOT EXISTS `index_categories_on_year_id`
+  ON `categories` (`year_id`);
+CREATE UNIQUE INDEX IF NOT EXISTS `uc_yearName`
+  ON `categories` (`year_id`, `name`);
+
+CREATE TABLE IF NOT EXISTS `tasks` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` varchar(255) DEFAULT NULL,
+  `category_id` int(11) DEFAULT NULL REFERENCES `categories` (`id`),
+  `correct_result` varchar(255) DEFAULT NULL,
+  `property` varchar(255) DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE (`name`, `category_id`)
+);
+CREATE INDEX IF NOT EXISTS `index_tasks_on_category_id`
+  ON `tasks` (`category_id`);
+
+CREATE TABLE IF NOT EXISTS `tools` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `name` varchar(255) DEFAULT NULL,
+  `year_id` int(11) DEFAULT NULL REFERENCES `years` (`id`),
+  `importance` varchar(255) DEFAULT NULL,
+  `version` varchar(255) DEFAULT NULL,
+  `params` varchar(255) DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `tag` varchar(20) DEFAULT NULL,
+  `note` varchar(255) DEFAULT NULL,
+  `fingerprint` char(40) DEFAULT NULL UNIQUE
+);
+CREATE INDEX IF NOT EXISTS `index_tools_on_year_id` ON `tools` (`year_id`);
+
+-- witness and witness_output are not in database.sql,
+-- but satt stores them
+CREATE TABLE IF NOT EXISTS `task_results` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `tool_id` int(11) DEFAULT NULL REFERENCES `tools` (`id`) ON DELETE CASCADE,
+  `task_id` int(11) DEFAULT NULL REFERENCES `tasks` (`id`),
+  `result` varchar(255) DEFAULT NULL,
+  `witness` varchar(255) DEFAULT NULL,
+  `is_correct` tinyint(1) DEFAULT NULL,
+  `points` float DEFAULT NULL,
+  `cpu_time` float DEFAULT NULL,
+  `memory_usage` float DEFAULT NULL,
+  `created_at` timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `output` text,
+  `witness_output` text,
+  `run_id` varchar(15) DEFAULT NULL,
+  UNIQUE (`tool_id`, `task_id`)
+);
+CREATE INDEX IF NOT EXISTS `index_task_results_on_task_id`
+  ON `task_results` (`task_id`);
+CREATE INDEX IF NOT EXISTS `index_task_results_on_tool_id`
+  ON `task_results` (`tool_id`);
+CREATE INDEX IF NOT EXISTS `index_task_results_on_run_id`
+  ON `task_results` (`run_id`, `tool_id`);
+CREATE INDEX IF NOT EXISTS `index_task_results_on_tool_task_result`
+  ON `task_results` (`tool_id`, `task_id`, `result`);
+
+-- summaries of the results, see summaries.py
+CREATE TABLE IF NOT EXISTS `run_summaries` (
+  `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+  `run_id` varchar(15) DEFAULT NULL,
+  `tool_id` int(11) DEFAULT NULL REFERENCES `tools` (`id`) ON DELETE CASCADE,
+  `category_id` int(11) DEFAULT NULL REFERENCES `categories` (`id`),
+  `result` varchar(255) DEFAULT NULL,
+  `is_correct` tinyint(1) DEFAULT NULL,
+  `witness` varchar(255) DEFAULT NULL,
+  `num_results` int(11) NOT NULL DEFAULT '0',
+  `points` float NOT NULL DEFAULT '0',
+  `cpu_time` float NOT NULL DEFAULT '0',
+  `memory_usage` float NOT NULL DEFAULT '0',
+  UNIQUE (`run_id`, `tool_id`, `category_id`, `result`, `is_correct`,
+          `witness`)
+);
+CREATE INDEX IF NOT EXISTS `index_run_summaries_on_tool_id`
+  ON `run_summaries` (`tool_id`, `category_id`);
+CREATE INDEX IF NOT EXISTS `index_run_summaries_on_category_id`
+  ON `run_summaries` (`category_id`);
+
+-- the migrations that are in this file (see ./db-cli migrate)
+CREATE TABLE IF NOT EXISTS `schema_migrations` (
+  `version` varchar(255) NOT NULL UNIQUE
+);
+INSERT INTO `schema_migrations` (`version`) VALUES ('001_unique_keys');
+INSERT INTO `schema_migrations` (`version`) VALUES ('002_result_indexes');
+INSERT INTO `schema_migrations` (`version`) VALUES ('003_run_summaries');
@@ -37,7 +37,7 @@ class RatingMethod(object):
                          'true_correct, true_incorrect '
                          'FROM rating_methods INNER JOIN years '
                          'ON rating_methods.year_id = years.id '
-                         'WHERE year = \'{0}\';'.format(configs.configs['year']))
+                         'WHERE year = %s;', [configs.configs['year']])
         if not res:
             err('Failed getting rating methods')
 
@@ -79,15 +79,30 @@ def None2Zero(x):
         return 0
     return x
 
-def Empty2Null(x):
-    if x == '':
-        return 'NULL'
-
-    return '\'{0}\''.format(x.strip())
-
 def get_name(name):
     return basename(name)
 
+# the queries over many results (db-cli explain checks them)
+KNOWN_RESULTS_QUERY = """
+        SELECT categories.name, tasks.name
+        FROM task_results
+            INNER JOIN tasks ON task_results.task_id = tasks.id
+            INNER JOIN categories ON tasks.category_id = categories.id
+        WHERE task_results.tool_id = %s and categories.year_id = %s;
+        """
+
+EXPECTED_TIMES_QUERY = """
+        SELECT categories.name, tasks.name, AVG(cpu_time)
+        FROM task_results
+            INNER JOIN tasks ON task_results.task_id = tasks.id
+            INNER JOIN categories ON tasks.category_id = categories.id
+            INNER JOIN years ON categories.year_id = years.id
+        WHERE task_results.tool_id IN
+                (SELECT id FROM tools WHERE name = %s or tag = %s)
+              and years.year = %s and cpu_time > 0
+        GROUP BY categories.name, tasks.name;
+        """
+
 class DatabaseProxy(object):
     def __init__(self, conffile = None):
         self._db = DatabaseConnection(conffile)
@@ -106,10 +121,9 @@ class DatabaseProxy(object):
 
     def getYearID(self, year):
         q = """
-        SELECT id FROM years WHERE year = '{0}';
-        """.format(year);
-
-        res = self._db.query(q)
+        SELECT id FROM years WHERE year = %s;
+        """
+        res = self._db.query(q, [year])
         if not res:
             return None
 
@@ -118,10 +132,10 @@ class DatabaseProxy(object):
     def getToolID(self, tool, version, tool_params, year_id):
         q = """
         SELECT id FROM tools
-        WHERE name = '{0}' and version = '{1}'
-              and params = '{2}' and year_id = '{3}';
-        """.format(tool, version, tool_params, year_id)
-        res = self._db.query(q)
+        WHERE name = %s and version = %s
+              and params = %s and year_id = %s;
+        """
+        res = self._db.query(q, [tool, version, tool_params, year_id])
         if not res:
             return None
 
@@ -132,9 +146,9 @@ class DatabaseProxy(object):
         q = """
         SELECT id FROM categories
         WHERE
-            year_id = '{0}' and name = '{1}';
-        """.format(year_id, category_name)
-        res = self._db.query(q)
+            year_id = %s and name = %s;
+        """
+        res = self._db.query(q, [year_id, category_name])
         if not res:
             return None
 
@@ -143,9 +157,9 @@ class DatabaseProxy(object):
     def getTaskID(self, category_id, name):
         q = """
         SELECT id FROM tasks
-        WHERE name = '{0}' and category_id = '{1}';
-        """.format(get_name(name), category_id)
-        res = self._db.query(q)
+        WHERE name = %s and category_id = %s;
+        """
+        res = self._db.query(q, [get_name(name), category_id])
         if not res:
             return None
 
@@ -154,9 +168,9 @@ class DatabaseProxy(object):
     def getTaskWithCorrectResult(self, category_id, name):
         q = """
         SELECT id, correct_result FROM tasks
-        WHERE name = '{0}' and category_id = '{1}';
-        """.format(get_name(rb.name), cat_id)
-        res = self._db.query(q)
+        WHERE name = %s and category_id = %s;
+        """
+        res = self._db.query(q, [get_name(name), category_id])
         if not res:
             return None
 
@@ -165,11 +179,35 @@ class DatabaseProxy(object):
     def hasTaskResult(self, task_id, tool_id):
         q = """
         SELECT count(*) FROM task_results
-        WHERE task_id = '{0}' and tool_id = '{1}';
-        """.format(task_id, tool_id)
-        res = self._db.query(q)
+        WHERE task_id = %s and tool_id = %s;
+        """
+        res = self._db.query(q, [task_id, tool_id])
         if not res:
             return False
 
         return res[0][0] != 0
 
+    def getKnownResults(self, tool_id, year_id):
+        """
+        Return set of (category name, task name) of the tasks
+        from the year that have a result for the tool
+        """
+
+        res = self._db.query(KNOWN_RESULTS_QUERY, [tool_id, year_id])
+
+        return set([(r[0], r[1]) for r in res])
+
+    def getExpectedTimes(self, tool, tag, year):
+        """
+        Return dictionary (category name, task name) -> average cpu time
+        of the task in the previous runs of tools with given name or tag
+        on the benchmarks of the year (they change between the years)
+        """
+
+        res = self._db.query(EXPECTED_TIMES_QUERY, [tool, tag, year])
+
+        times = dict()
+        for r in res:
+            times[(r[0], r[1])] = float(r[2])
+
+        return times
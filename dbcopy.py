@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Copy results between two databases (e.g. MySQL and a sqlite file).
+# The rows are matched by what identifies them (year, category name,
+# task name, tool name + version + params, ...), not by ids, so that
+# we can copy results into a database that already has other results.
+# Results that the target database already has are skipped.
+
+from common import dbg
+from log import satt_log
+from resolver import tool_fingerprint
+from summaries import rebuild
+
+# how many results we insert by one statement
+BATCH = 500
+
+def _rows(db, table, cols):
+    return db.query('SELECT {0} FROM {1};'.format(', '.join(cols), table))
+
+def _insert(db, table, cols, rows):
+    q = 'INSERT INTO {0} ({1}) VALUES ({2});'\
+        .format(table, ', '.join(cols), ', '.join(['%s'] * len(cols)))
+
+    for i in range(0, len(rows), BATCH):
+        db.executemany(q, rows[i:i + BATCH])
+
+def _copy_table(src, dst, table, key, cols, idmaps = {}):
+    """
+    Copy rows of the table that dst does not have and return mapping
+    of ids in src to ids in dst. key are the columns that identify
+    the row, idmaps maps the columns with ids of other tables
+    """
+    def mapped(row):
+        row = list(row)
+        for i, c in enumerate(key + cols):
+            if idmaps.has_key(c):
+                row[i] = idmaps[c].get(row[i])
+        return tuple(row)
+
+    known = dict()
+    for r in _rows(dst, table, ['id'] + key):
+        known[tuple(r[1:])] = r[0]
+
+    idmap = dict()
+    new = 0
+    for r in _rows(src, table, ['id'] + key + cols):
+        row = mapped(r[1:])
+        k = row[:len(key)]
+        if not known.has_key(k):
+            # insert the new rows one by one, we need their ids
+            _insert(dst, table, key + cols, [row])
+            q = 'SELECT id FROM {0} WHERE {1} ORDER BY id;'.format(table,
+                ' and '.join(['{0} = %s'.format(c) for c, v in zip(key, k)
+                              if not v is None]))
+            res = dst.query(q, [v for v in k if not v is None])
+            known[k] = res[-1][0]
+            new += 1
+
+        idmap[r[0]] = known[k]
+
+    dbg('{0}: {1} rows, {2} new'.format(table, len(idmap), new))
+    return idmap
+
+def _fingerprint_tools(dst, ids):
+    """ Set the fingerprint (see resolver.py) of the copied tools """
+    ids = set(ids)
+    for r in _rows(dst, 'tools', ['id', 'name', 'version', 'params',
+                                  'year_id', 'fingerprint']):
+        if r[0] in ids and r[5] is None:
+            dst.execute('UPDATE tools SET fingerprint = %s WHERE id = %s;',
+                        [tool_fingerprint(*r[1:5]), r[0]])
+
+def copy_results(src, dst):
+    """
+    Copy years, rating methods, categories, tasks, tools and results
+    from src to dst (DatabaseConnection). Return the number of copied
+    results.
+    """
+    years = _copy_table(src, dst, 'years', ['year'],
+                        ['created_at', 'updated_at', 'svn_revision'])
+
+    has_rating = set([r[0] for r in _rows(dst, 'rating_methods', ['year_id'])])
+    rating = ['year_id', 'unknown', 'false_correct', 'false_incorrect',
+              'true_correct', 'true_incorrect']
+    rows = [(years[r[0]],) + tuple(r[1:])
+            for r in _rows(src, 'rating_methods', rating)
+            if not years[r[0]] in has_rating]
+    _insert(dst, 'rating_methods', rating, rows)
+
+    metas = _copy_table(src, dst, 'metacategories', ['year_id', 'name'],
+                        ['created_at'], {'year_id' : years})
+    cats = _copy_table(src, dst, 'categories', ['year_id', 'name'],
+                       ['created_at', 'metacategory_id'],
+                       {'year_id' : years, 'metacategory_id' : metas})
+    tasks = _copy_table(src, dst, 'tasks', ['category_id', 'name'],
+                        ['correct_result', 'property', 'created_at'],
+                        {'category_id' : cats})
+    tools = _copy_table(src, dst, 'tools',
+                        ['year_id', 'name', 'version', 'params'],
+                        ['importance', 'created_at', 'tag', 'note'],
+                        {'year_id' : years})
+    _fingerprint_tools(dst, tools.values())
+    dst.commit()
+
+    cols = ['tool_id', 'task_id', 'result', 'witness', 'is_correct',
+            'points', 'cpu_time', 'memory_usage', 'created_at', 'output',
+            'witness_output', 'run_id']
+
+    copied = 0
+    # the results with outputs may be big, copy them by tools
+    for srcid, dstid in tools.items():
+        has = set([r[0] for r in dst.query('SELECT task_id FROM task_results '
+                                           'WHERE tool_id = %s;', [dstid])])
+
+        res = src.query('SELECT {0} FROM task_results WHERE tool_id = %s;'
+                        .format(', '.join(cols)), [srcid])
+        rows = []
+        for r in res:
+            task_id = tasks.get(r[1])
+            if task_id is None or task_id in has:
+                continue
+
+            rows.append((dstid, task_id) + tuple(r[2:]))
+
+        _insert(dst, 'task_results', cols, rows)
+        if rows:
+            rebuild(dst, dstid)
+        dst.commit()
+
+        copied += len(rows)
+        if rows:
+            satt_log('Copied {0} results of tool {1} ({2} in the target)'
+                     .format(len(rows), srcid, dstid))
+
+    return copied
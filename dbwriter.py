@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Results are stored into the database by a separate thread with its own
+# connection, so that a slow database does not stop the dispatcher.
+# The reporter puts the rows into a bounded queue and the writer stores
+# them by batches (see MysqlReporter). If the queue is full,
+# the reporter keeps the rows and the dispatcher does not start new
+# benchmarks until the writer catches up. If the connection to the
+# database is lost, the writer stores the results into the spool.
+# The summaries of the results (summaries.py) are updated in the same
+# transaction as the results. The writer tells the reporter about every
+# result it committed (or wrote into the spool), so that the journal
+# says that a benchmark finished only when its result is stored.
+
+import sys
+import threading
+import Queue
+from time import time
+
+from common import err, dbg, colored
+from log import satt_log
+from database import DatabaseConnection, DatabaseUnreachable, is_unreachable
+from summaries import store_summaries
+
+INSERT_RESULT = """
+        INSERT INTO task_results
+        (tool_id, task_id, result, witness, is_correct, points, cpu_time,
+         memory_usage, output, witness_output, run_id)
+        VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """
+
+def _exception_handler(args, data):
+    q, tool_id, task_id, ignore_duplicates = data
+
+    if is_unreachable(args):
+        raise DatabaseUnreachable(args[1])
+    elif (args[1].startswith('Duplicate entry')):
+
+        if ignore_duplicates:
+            satt_log('Already has this result for this tool, ignoring.')
+        else:
+            err('Already has result of this benchmark for this tool.\n'
+                'It is only supported to have one result for each '
+                'benchmark and particular tool\n'
+                'If want ignore this behaviour use --ignore-duplicates.\n'
+                '(tool + version + params). You can delete the old result:\n'
+                '  $ ./db-cli \'DELETE from task_results WHERE tool_id={0}'
+                ' and task_id={1}\'\n'
+                '  $ ./db-cli summarize\n'
+                'or you can delete all results for this tool:\n'
+                '  $ ./db-cli \'DELETE from tools WHERE id={0}\'\n'
+                .format(tool_id, task_id, tool_id))
+    else:
+        err('Failed querying db: {0}\n\n{1}'.format(args[1], q))
+
+class DbWriter(threading.Thread):
+    """ Store results (rows of task_results) into the database """
+
+    def __init__(self, batch, interval, size, spool = None, stored = None,
+                 ignore_duplicates = False):
+        """
+        stored(benchmark) is called (from the writer thread)
+        for every result that was committed or spooled.
+        The writer does not read the configs, the daemon
+        changes them while we are storing results of a run.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self._ignore_duplicates = ignore_duplicates
+        self._spool = spool
+        self._on_stored = stored
+        # we lost the connection, the results go to the spool
+        self.offline = False
+        self._db = DatabaseConnection(raise_unreachable = not spool is None)
+        self._batch = batch
+        self._interval = interval
+        self._queue = Queue.Queue(size)
+        # sys.exc_info() of the exception that ended the writer
+        self._error = None
+
+        # (row, tool_id, task_id, benchmark, category_id)
+        # that are not stored yet
+        self._pending = []
+        # the pending results that were inserted
+        self._stored = []
+        self._last_write = time()
+
+    def put(self, item, block = False):
+        """
+        Queue (row, tool_id, task_id, benchmark, category_id) for storing.
+        Return False if the queue is full (or the writer ended)
+        and we should not block
+        """
+        while self.is_alive():
+            try:
+                self._queue.put(('row', item), block, 1)
+                return True
+            except Queue.Full:
+                if not block:
+                    return False
+
+        return False
+
+    def flush(self):
+        """ Wait until all queued rows are stored """
+        done = threading.Event()
+        if not self._putJob(('flush', done)):
+            return
+
+        # wait() without timeout can not be interrupted
+        while self.is_alive() and not done.wait(1):
+            pass
+
+    def stop(self):
+        if self._putJob(('stop', None)):
+            self.join()
+
+    def check(self):
+        """ Raise the exception that ended the writer (in our thread) """
+        if not self._error is None:
+            error = self._error
+            self._error = None
+            raise error[0], error[1], error[2]
+
+    def failed(self):
+        return not self._error is None
+
+    def _putJob(self, job):
+        while self.is_alive():
+            try:
+                self._queue.put(job, True, 1)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def _insertOneByOne(self, args, pending):
+        """
+        Inserting all the results failed (the statement is atomic, so
+        nothing was inserted), insert them one by one to find out which
+        of them is the problem
+        """
+        if is_unreachable(args):
+            raise DatabaseUnreachable(args[1])
+
+        dbg('Storing results failed ({0}), storing them one by one'
+            .format(args[1]))
+
+        self._stored = []
+        for p in pending:
+            row, tool_id, task_id = p[0], p[1], p[2]
+            data = (INSERT_RESULT, tool_id, task_id, self._ignore_duplicates)
+            res = self._db.query_with_exception_handler(INSERT_RESULT,
+                                                        _exception_handler,
+                                                        data, row)
+            # the handler returns None (ignored duplicate)
+            if not res is None:
+                self._stored.append(p)
+
+    def _write(self):
+        """ Store pending results by one insert and one commit """
+        self._last_write = time()
+
+        if not self._pending:
+            return
+
+        pending = self._pending
+        self._pending = []
+
+        if not self.offline:
+            try:
+                self._stored = pending
+                self._db.executemany_with_exception_handler(INSERT_RESULT,
+                                    [p[0] for p in pending],
+                                    self._insertOneByOne, pending)
+                store_summaries(self._db, self._stored)
+                self._db.commit()
+                # the ignored duplicates are in the database too
+                self._done(pending)
+                return
+            except DatabaseUnreachable as e:
+                # nothing of the batch was commited
+                satt_log(colored('WARN: Lost connection to the database '
+                                 '({0}), storing results to {1}'
+                                 .format(e, self._spool.path), 'red'))
+                self.offline = True
+
+        for p in pending:
+            self._spool.write(p[3])
+        self._done(pending)
+
+    def _done(self, pending):
+        if self._on_stored is None:
+            return
+
+        for p in pending:
+            self._on_stored(p[3])
+
+    def run(self):
+        try:
+            self._run()
+        # err() calls sys.exit() that would end only this thread
+        except BaseException:
+            self._error = sys.exc_info()
+        finally:
+            # if we failed, the rows we did not commit would keep
+            # the tables locked (the daemon goes on with other runs)
+            self._db.close()
+
+    def _run(self):
+        while True:
+            timeout = self._interval - (time() - self._last_write)
+            try:
+                what, data = self._queue.get(True, max(timeout, 0.1))
+            except Queue.Empty:
+                what, data = 'timeout', None
+
+            if what == 'row':
+                self._pending.append(data)
+            elif what == 'flush':
+                self._write()
+                data.set()
+                continue
+            elif what == 'stop':
+                self._write()
+                return
+
+            if len(self._pending) >= self._batch or\
+               time() - self._last_write >= self._interval:
+                self._write()
@@ -30,15 +30,24 @@ import subprocess
 import select
 import fcntl
 import os
+import errno
+import signal
+import time
 from time import strftime
 
-from common import err, dbg
-from tasks import Task
+from common import err, dbg, colored
+from tasks import Task, BenchmarkQueue
 from configs import configs
 from log import satt_log
 
 class RunningTask(object):
     """ This class represents ont running task """
+
+    # how much we read from the benchmark's output at once
+    CHUNK_SIZE = 65536
+    # how many chunks we read before we look at other benchmarks
+    MAX_READS = 4
+
     def __init__(self, cmd, proc, task, name, cat):
         # these are public, this is just a record in
         # a dictioary
@@ -60,7 +69,13 @@ class RunningTask(object):
         self.witness = ''
         self.witness_output = ''
 
+        # when the process (or benchmark in batch) started
+        self.started = time.time()
+        # where the command wrote its process group ({pidfile})
+        self.pidfile = None
+
         self._state = None # what are we just reading?
+        self._chunks = [] # not finished line of the output
 
     def storeOutput(self, msg):
         maxlen = 10000
@@ -83,8 +98,101 @@ class RunningTask(object):
 
         self.outputlen += copylen
 
-    def readOutput(self):
-        return self.proc.stdout.readline()
+    def feed(self, data):
+        """
+        Take a chunk of the output of the benchmark and return
+        the lines that are complete (without the newline).
+        Empty data means end of the output.
+        """
+        if not data:
+            rest = ''.join(self._chunks)
+            self._chunks = []
+            if rest:
+                return [rest]
+            return []
+
+        # join the chunks only when some line is finished,
+        # a long line would be copied over and over again
+        self._chunks.append(data)
+        if not '\n' in data:
+            return []
+
+        lines = ''.join(self._chunks).split('\n')
+        # the last item is not finished line (or empty string)
+        rest = lines.pop()
+        if rest:
+            self._chunks = [rest]
+        else:
+            self._chunks = []
+
+        return lines
+
+    def readLines(self, drain = False):
+        """
+        Read what is available on the (non-blocking) output of
+        the benchmark and return complete lines. Read at most MAX_READS
+        chunks, so that a chatty benchmark does not hold up the others,
+        or everything up to the end of the output if drain is True.
+        """
+        fd = self.proc.stdout.fileno()
+        lines = []
+        reads = 0
+
+        while drain or reads < RunningTask.MAX_READS:
+            try:
+                data = os.read(fd, RunningTask.CHUNK_SIZE)
+            except OSError as e:
+                if e.errno == errno.EAGAIN or e.errno == errno.EINTR:
+                    return lines
+                raise
+
+            reads += 1
+            lines += self.feed(data)
+            if not data:
+                return lines
+
+        return lines
+
+    def wait(self):
+        """ Wait for the process to end """
+        return self.proc.wait()
+
+    def kill(self):
+        """
+        Kill the command with all its processes (ssh, shell, ...).
+        If the command wrote its process group into {pidfile}, kill also
+        its processes on the machine. Return the process that kills them
+        (it prints their number) or None
+        """
+        killer = None
+        if self.pidfile:
+            killer = self.task.killProcesses(self.pidfile)
+            self.pidfile = None
+
+        try:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+            # for sure
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            # the processes have just ended
+            pass
+
+        return killer
+
+    def isBatch(self):
+        return False
+
+    def running(self):
+        """ Return the benchmark whose output we read now """
+        return self
+
+    def takeFinished(self):
+        """ Return benchmarks that are done, but the process still runs """
+        return []
+
+    def finish(self):
+        """ The process ended, return benchmarks that are done """
+        return [self]
 
     def dumpToFile(self, msg = None):
         # XXX make this a method of RunningTask
@@ -122,33 +230,169 @@ class RunningTask(object):
 
         f.close()
 
+class RunningBatch(RunningTask):
+    """
+    More benchmarks from one category run by one process. The output
+    of every benchmark starts with '=== BENCHMARK' line followed
+    by the name of the benchmark. The reporter routes the lines
+    to the right RunningTask (see BenchmarkReport.report)
+    """
+    def __init__(self, cmd, proc, task, names, cat):
+        RunningTask.__init__(self, cmd, proc, task,
+                             '<batch of {0}>'.format(len(names)), cat)
+
+        self.benchmarks = []
+        self._names = dict()
+        for name in names:
+            rb = RunningTask(cmd, proc, task, name, cat)
+            self.benchmarks.append(rb)
+            self._names[name] = rb
+
+        self.current = None
+        self._finished = []
+        self._unfinished = list(self.benchmarks)
+
+    def isBatch(self):
+        return True
+
+    def running(self):
+        return self.current
+
+    def switchTo(self, name):
+        """ The output of benchmark 'name' follows """
+        if not self.current is None:
+            self._finished.append(self.current)
+
+        # the timeout is for every benchmark in the batch
+        self.started = time.time()
+
+        self.current = self._names.get(name)
+        if self.current is None:
+            self.storeOutput('Unknown benchmark in batch: {0}\n'.format(name))
+        elif self.current in self._unfinished:
+            self._unfinished.remove(self.current)
+
+    def takeFinished(self):
+        fin = self._finished
+        self._finished = []
+        return fin
+
+    def finish(self):
+        fin = self.takeFinished()
+        if not self.current is None:
+            fin.append(self.current)
+            self.current = None
+
+        # these did not even start, give them the output
+        # of the batch so that we know what happened
+        for rb in self._unfinished:
+            rb.storeOutput(self.output)
+        fin += self._unfinished
+        self._unfinished = []
+
+        return fin
+
 class Dispatcher(object):
     """ Dispatch symbiotic instances between computers """
 
-    def __init__(self, tasks = [], report = None):
+    def __init__(self, tasks = [], queue = None, report = None):
         self._tasks = tasks
         self._poller = select.poll()
         self._fds = dict()
-        self._benchmarks_count = 0
+        # number of running benchmarks on every task
+        self._running = dict()
         self._benchmarks_done = 0
 
-        # initialize benchmarks_count
-        for t in tasks:
-            self._benchmarks_count += t.getCount()
+        # benchmarks are shared by all tasks, every machine that
+        # has a free slot takes the next one from this queue
+        if queue is None:
+            self._queue = BenchmarkQueue()
+        else:
+            self._queue = queue
+
+        self._benchmarks_count = self._queue.getCount()
+
+        self._readRunConfigs()
+
+        # when the queue is empty, run a copy of benchmarks
+        # that run long on another machine
+        self._speculate = configs['speculate'] == 'yes'
+        try:
+            self._speculate_after = float(configs['speculate-after'])
+        except ValueError:
+            err('Invalid speculate-after: {0}'.format(configs['speculate-after']))
+        # benchmark -> its copy and copy -> benchmark
+        self._twins = dict()
+        # (process, benchmark) of running kills on machines
+        self._killers = []
 
         # we must import it only localy, otherwise we get
         # cyclic dependency
         import reporter
 
         if report is None:
-            if configs['no-db'] == 'yes':
-                self._report = reporter.StdoutReporter()
-            else:
-                self._report = reporter.MysqlReporter()
+            self._report = reporter.create_reporter()
         else:
             self._report = report
 
         self._dontSendResults = False
+        self._journal = None
+        self._health = None
+        self._adaptive = None
+
+    def _readRunConfigs(self):
+        """ Take how to run the benchmarks from the configs of the run """
+        try:
+            self._batch_size = int(configs['batch-size'])
+        except ValueError:
+            err('Invalid batch size: {0}'.format(configs['batch-size']))
+
+        # there is no one directory for more benchmarks
+        if self._batch_size > 1:
+            for var in ['{benchmark-dirname}', '{file-dirname}']:
+                if var in configs.get('cmd', ''):
+                    err('{0} can not be used with --batch-size'.format(var))
+
+        try:
+            self._max_attempts = int(configs['max-attempts'])
+            self._retry_delay = float(configs['retry-delay'])
+        except ValueError:
+            err('Invalid max-attempts or retry-delay')
+
+        # benchmarks that run longer are killed, the tool
+        # should stop them on timeout, but ssh may hang
+        self._time_limit = None
+        if configs.has_key('timeout'):
+            try:
+                self._time_limit = float(configs['timeout']) +\
+                                   float(configs['timeout-grace'])
+            except ValueError:
+                err('Invalid timeout or timeout-grace')
+
+    def setJournal(self, journal, done = 0):
+        """
+        Record what happens to benchmarks into the journal.
+        done is the number of benchmarks that finished before
+        (when resuming the run)
+        """
+        self._journal = journal
+        self._benchmarks_done = done
+        # a benchmark is finished when its result is stored,
+        # that is not when the reporter is done with it
+        self._report.onStored(journal.finished)
+        self._benchmarks_count = self._queue.getCount() + done
+
+        if done != 0:
+            prgs = float(self._benchmarks_done) / self._benchmarks_count
+            self._progressReport(int(prgs * 100))
+
+    def setHealthMonitor(self, monitor):
+        """ Take machines out of rotation when the monitor says so """
+        self._health = monitor
+
+    def setAdaptiveParallelism(self, adaptive):
+        """ Let adaptive change the number of slots of machines """
+        self._adaptive = adaptive
 
     def sendResults(self):
         """ Send results by e-mail to given people """
@@ -177,7 +421,6 @@ class Dispatcher(object):
         """ Add new task """
 
         self._tasks.append(task)
-        self._benchmarks_count += task.getCount()
 
     def _registerFd(self, fd, data):
         """ Add new fd to the poller """
@@ -205,81 +448,359 @@ class Dispatcher(object):
         fd = bench.proc.stdout.fileno()
         self._registerFd(fd, bench)
 
+        self._running[bench.task] = self._running.get(bench.task, 0) + 1
+
     def _runBenchmark(self, task):
-        """ Run another benchmark from task """
+        """ Run another benchmark from the queue on task """
+
+        if self._batch_size > 1:
+            benches = self._queue.popBatch(self._batch_size, task)
+            if not benches: # no more tests to run
+                return None
+
+            bench = task.runBatch(configs['cmd'], benches)
+        else:
+            b = self._queue.pop(task)
+            if b is None: # no more tests to run
+                return None
 
-        bench = task.runBenchmark(configs['cmd'])
-        if bench is None: # no more tests to run
-            return None
+            bench = task.runBenchmark(configs['cmd'], b)
 
         self._registerBenchmark(bench)
 
+        if self._journal:
+            if bench.isBatch():
+                for rb in bench.benchmarks:
+                    self._journal.started(rb)
+            else:
+                self._journal.started(bench)
+
         return bench
 
     def _getBenchmark(self, fd):
         return self._fds[fd]
 
+    def _runningBenchmarks(self):
+        return self._fds.values()
+
+    def _dropBenchmark(self, bench):
+        """ Kill the benchmark and stop tracking it """
+        self._unregisterFd(bench.proc.stdout.fileno())
+        self._running[bench.task] -= 1
+
+        self._addKiller(bench, bench.kill())
+        bench.wait()
+
     def _is_running(self):
         return self._fds != {}
 
+    def _has_work(self):
+        return self._is_running() or not self._queue.empty()
+
     def _poll_wait(self):
-        return self._poller.poll()
+        # wake up once in a while to run the benchmarks
+        # that waited for another try
+        return self._poller.poll(1000)
+
+    def _reapHung(self):
+        """ Kill benchmarks that run longer than timeout with grace """
+        now = time.time()
+        for bench in list(self._runningBenchmarks()):
+            limit = self._timeLimit(bench)
+            if limit is None or now - bench.started < limit:
+                continue
+
+            satt_log(colored('WARN: {0} on {1} runs for {2:.0f} s, killing it'
+                             .format(bench.name, bench.task.getMachine(),
+                                     now - bench.started), 'red'))
+
+            hung = bench.running()
+            self._dropBenchmark(bench)
+
+            # let the copy finish it
+            if not self._untwin(bench) is None:
+                continue
+
+            # benchmarks from a batch that did not start
+            # have no result, so they are run again
+            for rb in bench.finish():
+                if rb is hung and rb.result is None:
+                    # if it said something, it was working on it
+                    if rb.outputlines > 0:
+                        rb.result = 'TIMEOUT'
+                    else:
+                        rb.result = 'ERROR'
+
+                    rb.storeOutput('Killed by satt after {0:.0f} s\n'
+                                   .format(now - rb.started))
+
+                self._benchmarkDone(rb)
+
+    def _timeLimit(self, bench):
+        """ How long can the benchmark run (None for no limit) """
+        return self._time_limit
+
+    def _maintain(self):
+        """ What we do once in a while (and after benchmarks finish) """
+        self._collectKillers()
+        self._checkHealth()
+
+        if self._adaptive:
+            self._adaptive.adjust(self._running)
+
+        self._reapHung()
+        self._fillSlots()
+        self._runTwins()
+        self._tickReport()
+
+    def _tickReport(self):
+        """ Let the reporter store the results it holds for too long """
+        self._report.tick()
+
+    def _flushReport(self):
+        self._report.flush()
+
+    def _progressReport(self, progress):
+        self._report.progress(progress)
+
+    def _isReportBacklogged(self):
+        return self._report.backlogged()
+
+    def _evictTask(self, task):
+        """ Requeue benchmarks running on the task """
+        for bench in list(self._runningBenchmarks()):
+            if bench.task != task:
+                continue
+
+            self._dropBenchmark(bench)
+
+            # the copy keeps running
+            if not self._untwin(bench) is None:
+                continue
+
+            # it is not their fault, so this is not a failed attempt
+            for rb in bench.finish():
+                self._requeue(rb)
+
+    def _requeue(self, rb):
+        """ Put the benchmark back to the queue """
+        self._queue.readd(rb)
+        if self._journal:
+            self._journal.requeued(rb)
+
+    def _checkHealth(self):
+        if self._health is None:
+            return
+
+        for task, up, reason in self._health.changes():
+            if up:
+                satt_log('{0} {1}, running benchmarks on it again'
+                         .format(task.getMachine(), reason))
+            else:
+                satt_log(colored('WARN: {0} {1}, taking it out of rotation'
+                                 .format(task.getMachine(), reason), 'red'))
+                self._evictTask(task)
+
+                # the probes (or the cool-down without them) bring
+                # the machines back, so we wait even if nothing runs
+                if not self._health.anyUp():
+                    satt_log(colored('WARN: No machine is in rotation, waiting'
+                                     ' for some to get back', 'red'))
+
+    def _fillSlots(self):
+        """ Run benchmarks on every free slot """
+        # the db is behind, wait until the results are stored
+        # (the slots are filled again from _maintain())
+        if self._isReportBacklogged():
+            return
+
+        for task in self._tasks:
+            if self._health and not self._health.isUp(task):
+                continue
+
+            while self._running.get(task, 0) < task.getParallel():
+                if self._runBenchmark(task) is None:
+                    break
+
+    def _addKiller(self, bench, killer):
+        if not killer is None:
+            self._killers.append((killer, bench))
+
+    def _collectKillers(self, block = False):
+        """ Log how many processes the finished kills on machines killed """
+        running = []
+        for p, bench in self._killers:
+            if not block and p.poll() is None:
+                running.append((p, bench))
+                continue
+
+            out = p.communicate()[0].strip()
+            try:
+                num = int(out.split('\n')[-1])
+            except ValueError:
+                satt_log(colored('WARN: Failed killing {0} on {1}: {2}'
+                                 .format(bench.name, bench.task.getMachine(),
+                                         out), 'red'))
+                continue
+
+            satt_log('Killed {0} processes of {1} on {2}'
+                     .format(num, bench.name, bench.task.getMachine()))
+
+        self._killers = running
 
     def _killTasks(self):
         for bench in self._fds.values():
-            bench.proc.terminate()
-            # for sure
-            bench.proc.kill()
+            self._addKiller(bench, bench.kill())
+
+        self._collectKillers(True)
 
     def _monitorTasks(self):
-        assert self._is_running()
+        assert self._has_work()
 
-        while self._is_running():
+        while self._has_work():
             for fd, flags in self._poll_wait():
+                # the copy of benchmark that was killed
+                # in this round (see _benchmarkFinished)
+                if not fd in self._fds:
+                    continue
+
                 if flags & select.POLLERR:
                     self._killTasks()
                     err('Waiting for benchmark failed')
 
                 if flags & select.POLLIN:
                     bench = self._getBenchmark(fd)
-                    try:
-                        data = bench.readOutput()
-                        while data:
-                            self._report.report(data, bench)
-                            data = bench.readOutput()
-                    # While can be too fast and raise
-                    # EBUSY
-                    except IOError:
-                        continue
+                    for line in bench.readLines():
+                        self._report.report(line, bench)
+
+                    # benchmarks from a batch are done
+                    # before the whole batch
+                    for rb in bench.takeFinished():
+                        self._benchmarkDone(rb)
 
                 # is benchmark done?
                 if flags & select.POLLHUP:
                     # remove the old benchmark
                     bench = self._unregisterFd(fd)
-                    if not self._report.done(bench):
-                        # something went wrong - queue this one again
-                        satt_log('Running benchmark again');
-                        # we must take this one as it was not running yet
-                        self._benchmarks_done -= 1
-
-                        # XXX we do not have a mechanism how to track
-                        # how many times the benchmark ran, so it may happen
-                        # that it will run indifinetly many times.
-                        # It seems we don't need to care about that atm, so let's
-                        # ignore it for now.
-                        #
-                        # P. S message for future me: If you read this, we probably hit
-                        # this error and you hate me and my wickidness - just sorry.
-                        bench.task.readd(bench)
-
-                    self._benchmarks_done += 1
-                    # set progress
-                    if self._benchmarks_done != 0:
-                        prgs = float(self._benchmarks_done) / self._benchmarks_count
-                        self._report.progress(int(prgs * 100))
-
-                    # run new benchmark
-                    self._runBenchmark(bench.task)
+
+                    # read the rest of the output
+                    # (and the last unfinished line)
+                    for line in bench.readLines(True):
+                        self._report.report(line, bench)
+
+                    self._running[bench.task] -= 1
+
+                    for rb in bench.finish():
+                        self._benchmarkFinished(rb)
+
+            # run new benchmarks on the slots that are free now
+            self._maintain()
+
+    def _untwin(self, bench):
+        """ Forget the copy of the benchmark, return it (or None) """
+        twin = self._twins.pop(bench, None)
+        if not twin is None:
+            self._twins.pop(twin)
+
+        return twin
+
+    def _benchmarkFinished(self, bench):
+        """ The process of the benchmark (not batch) ended """
+        twin = self._untwin(bench)
+        if not twin is None:
+            if bench.result is None:
+                # this one failed, but the other one may make it
+                dbg('Copy of {0} on {1} failed'.format(bench.name,
+                                                      bench.task.getMachine()))
+                return
+
+            satt_log('{0} finished on {1} first, killing it on {2}'
+                     .format(bench.name, bench.task.getMachine(),
+                             twin.task.getMachine()))
+            self._dropBenchmark(twin)
+
+        self._benchmarkDone(bench)
+
+    def _runTwins(self):
+        """
+        Run copies of benchmarks that run long on free slots of other
+        machines. Only when there is nothing else to run.
+        """
+        if not self._speculate or not self._queue.empty():
+            return
+
+        now = time.time()
+        long_running = [b for b in self._runningBenchmarks()
+                        if not b.isBatch() and not b in self._twins and
+                           now - b.started >= self._speculate_after]
+        if not long_running:
+            return
+
+        # the longest running first
+        long_running.sort(key = lambda b: b.started, reverse = True)
+
+        for task in self._tasks:
+            if self._health and not self._health.isUp(task):
+                continue
+
+            while self._running.get(task, 0) < task.getParallel():
+                mach = task.getMachine()
+                others = [b for b in long_running
+                          if b.task.getMachine() != mach]
+                if not others:
+                    break
+
+                bench = others[-1]
+                long_running.remove(bench)
+
+                dbg('Running copy of {0} on {1}'.format(bench.name, mach))
+                twin = task.runBenchmark(configs['cmd'],
+                                         (bench.name, bench.category))
+                self._registerBenchmark(twin)
+                self._twins[bench] = twin
+                self._twins[twin] = bench
+
+                if self._journal:
+                    self._journal.started(twin)
+
+    def _benchmarkDone(self, bench):
+        self._benchmarkReported(bench, self._report.done(bench))
+
+    def _benchmarkReported(self, bench, ok):
+        """ The reporter returned ok for the finished benchmark """
+        if self._health:
+            # the ERROR after the last attempt is not a result of the machine
+            if not ok or self._queue.attempts(bench) < self._max_attempts:
+                self._health.record(bench.task, ok)
+
+        if not ok:
+            attempts = self._queue.recordFailure(bench)
+            if attempts >= self._max_attempts:
+                satt_log('Benchmark failed {0} times, giving up'.format(attempts))
+
+                # report it again, now with the error
+                bench.result = 'ERROR'
+                bench.output = self._queue.history(bench) + bench.output
+                self._benchmarkDone(bench)
+                return
+
+            # something went wrong - queue this one again,
+            # but give the machine (or whatever failed) some time
+            delay = self._retry_delay * 2 ** (attempts - 1)
+            satt_log('Running benchmark again in {0:g} s'.format(delay))
+
+            # we must take this one as it was not running yet
+            self._benchmarks_done -= 1
+            self._queue.readd(bench, delay)
+
+            if self._journal:
+                self._journal.requeued(bench)
+
+        self._benchmarks_done += 1
+        # set progress
+        if self._benchmarks_done != 0:
+            prgs = float(self._benchmarks_done) / self._benchmarks_count
+            self._progressReport(int(prgs * 100))
 
     def run(self):
         """ Dispatch tasks over network and wait for outcomes """
@@ -289,15 +810,29 @@ class Dispatcher(object):
         # take every task and call as many of benchmarks as
         # you are allowed. Later, when a task ends,
         # we will spawn only one new (one new for one done)
+        if self._health:
+            self._health.start()
+        if self._adaptive:
+            self._adaptive.start()
+
         try:
-            for task in self._tasks:
-                for n in range(0, task.getParallel()):
-                    if self._runBenchmark(task) is None:
-                        break
+            self._fillSlots()
 
             # monitor the tasks
             self._monitorTasks()
+
+            # the copies killed at the end
+            self._collectKillers(True)
         except KeyboardInterrupt:
             self._dontSendResults = True
             self._killTasks()
             satt_log('Stopping...')
+        finally:
+            if self._health:
+                self._health.stop()
+            if self._adaptive:
+                self._adaptive.stop()
+
+            # the results of finished benchmarks are stored
+            # even if we were stopped
+            self._flushReport()
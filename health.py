@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Watch the machines during the run. A machine is taken out of rotation
+# when it does not answer (it is probed in a background thread) or when
+# too many of its recent benchmarks failed without a result. Machines
+# out of rotation are still probed and they get back once they answer.
+# Without probing (health-interval=0) they get back after COOLDOWN seconds.
+# The dispatcher asks for the changes from its own thread (see changes()),
+# so the state of the machines is touched only from the main thread.
+
+import os
+import time
+import threading
+import subprocess
+import Queue
+from collections import deque
+
+from common import err, dbg
+from configs import configs
+from ssh import ssh_command
+
+def _probe_cmd(machine):
+    if configs.has_key('ssh-cmd'):
+        # goes through the master connection if we have it,
+        # otherwise it connects on its own
+        return ssh_command(machine, ['true'],
+                           ['-o', 'BatchMode=yes', '-o', 'ConnectTimeout=10'])
+
+    return ['ping', '-c', '1', '-W', '10', machine]
+
+def probe(machine):
+    """ Return True if the machine answers """
+    devnull = open(os.devnull, 'w')
+    try:
+        ret = subprocess.call(_probe_cmd(machine),
+                              stdout = devnull, stderr = devnull)
+    except OSError as e:
+        dbg('Failed probing {0}: {1}'.format(machine, e.strerror))
+        ret = 1
+
+    devnull.close()
+    return ret == 0
+
+class Prober(threading.Thread):
+    """
+    Probe all machines every interval seconds, put pairs
+    of the task and what probe_fn returned for its machine
+    into the results queue
+    """
+
+    def __init__(self, tasks, interval, results, probe_fn = probe):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self._tasks = tasks
+        self._interval = interval
+        self._results = results
+        self._probe_fn = probe_fn
+        self._quit = threading.Event()
+
+    def stop(self):
+        self._quit.set()
+
+    def run(self):
+        while not self._quit.wait(self._interval):
+            # probe them parallely, a machine that is down
+            # would hold up the others for the whole timeout
+            procs = []
+            for t in self._tasks:
+                th = threading.Thread(target = self._probe, args = (t,))
+                th.daemon = True
+                th.start()
+                procs.append(th)
+
+            for th in procs:
+                th.join()
+
+    def _probe(self, task):
+        self._results.put((task, self._probe_fn(task.getMachine())))
+
+class HealthMonitor(object):
+    """ Decide which machines should get benchmarks """
+
+    # how many last results of a machine we look at
+    WINDOW = 10
+    # when machines are not probed, we try the evicted ones
+    # again after this time
+    COOLDOWN = 300
+
+    def __init__(self, tasks):
+        try:
+            self._interval = float(configs['health-interval'])
+            self._max_failures = int(configs['health-failures'])
+        except ValueError:
+            err('Invalid health-interval or health-failures')
+
+        self._tasks = list(tasks)
+        self._results = dict([(t, deque(maxlen = HealthMonitor.WINDOW))
+                              for t in self._tasks])
+        # task -> time when it was taken out of rotation
+        self._down = dict()
+        self._changes = []
+
+        self._probes = Queue.Queue()
+        self._prober = None
+
+    def start(self):
+        if self._interval > 0:
+            self._prober = Prober(self._tasks, self._interval, self._probes)
+            self._prober.start()
+
+    def stop(self):
+        if self._prober:
+            self._prober.stop()
+
+    def isUp(self, task):
+        return not task in self._down
+
+    def anyUp(self):
+        return len(self._down) < len(self._tasks)
+
+    def _evict(self, task, reason):
+        self._down[task] = time.time()
+        self._results[task].clear()
+        self._changes.append((task, False, reason))
+
+    def _readmit(self, task, reason = 'answers again'):
+        self._down.pop(task)
+        self._changes.append((task, True, reason))
+
+    def record(self, task, ok):
+        """ Remember whether the benchmark on task got a result """
+        if not task in self._results or not self.isUp(task):
+            return
+
+        res = self._results[task]
+        res.append(ok)
+
+        failed = len([r for r in res if not r])
+        if self._max_failures > 0 and failed >= self._max_failures:
+            self._evict(task, 'failed {0} of last {1} benchmarks'
+                              .format(failed, len(res)))
+
+    def changes(self):
+        """
+        Return list of (task, up, reason) for machines that
+        were taken out of rotation or got back since the last call
+        """
+        while True:
+            try:
+                task, ok = self._probes.get_nowait()
+            except Queue.Empty:
+                break
+
+            if self.isUp(task):
+                if not ok:
+                    self._evict(task, 'does not answer')
+            # give a machine that failed benchmarks at least
+            # one interval before we try it again
+            elif ok and time.time() - self._down[task] >= self._interval:
+                self._readmit(task)
+
+        # nothing would bring them back
+        if self._prober is None:
+            for task, since in self._down.items():
+                if time.time() - since >= HealthMonitor.COOLDOWN:
+                    self._readmit(task, 'was out of rotation for {0} s'
+                                        .format(HealthMonitor.COOLDOWN))
+
+        ch = self._changes
+        self._changes = []
+        return ch
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Journal of the run. Every queued, started and finished benchmark
+# is appended to the journal file as one line of tab separated values:
+#
+#   run       run_id  started_at  tool  year
+#   queued    name    category
+#   started   name    category    machine
+#   requeued  name    category
+#   finished  name    category    result
+#
+# A benchmark is finished when its result is stored (the results
+# for the database are committed by another thread, later than
+# the benchmarks end). From the journal we can rebuild the state
+# of the run if satt was killed (see load_journal)
+
+import threading
+
+from common import err
+from configs import configs
+
+def _drop_cut_line(path):
+    """
+    If we got killed while writing a line, remove the rest
+    of it so that we can continue appending to the journal
+    """
+    try:
+        f = open(path, 'r+')
+    except IOError:
+        # the journal does not exist yet
+        return
+
+    data = f.read()
+    if data and not data.endswith('\n'):
+        f.truncate(data.rfind('\n') + 1)
+
+    f.close()
+
+class Journal(object):
+    """ Append-only record of what happened to benchmarks in the run """
+
+    def __init__(self, path):
+        self.path = path
+
+        _drop_cut_line(path)
+
+        try:
+            self._file = open(path, 'a')
+        except IOError as e:
+            err('Failed opening journal {0}: {1}'.format(path, e.strerror))
+
+        # the benchmarks are recorded as finished by the thread
+        # that stores their results (see DbWriter)
+        self._lock = threading.Lock()
+
+    def _write(self, *vals):
+        with self._lock:
+            self._file.write('\t'.join([str(v) for v in vals]))
+            self._file.write('\n')
+            # if we get killed, we want to have everything
+            # up to this point in the file
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def header(self):
+        self._write('run', configs['run-id'], configs['started_at'],
+                    configs['tool'], configs['year'])
+
+    def queued(self, bench):
+        name, cat = bench
+        self._write('queued', name, cat)
+
+    def started(self, rb):
+        self._write('started', rb.name, rb.category, rb.task.getMachine())
+
+    def requeued(self, rb):
+        self._write('requeued', rb.name, rb.category)
+
+    def finished(self, rb):
+        self._write('finished', rb.name, rb.category, rb.result)
+
+def load_journal(path, queue):
+    """
+    Put benchmarks from the journal that did not finish into the queue
+    (in the original order) and set the run_id and start of the run
+    from the journal. Return the number of finished benchmarks.
+    """
+
+    try:
+        f = open(path, 'r')
+    except IOError as e:
+        err('Failed opening journal {0}: {1}'.format(path, e.strerror))
+
+    queued = []
+    finished = dict()
+    got_header = False
+
+    for num, line in enumerate(f):
+        # the last line may be cut if we got killed while writing it
+        if not line.endswith('\n'):
+            break
+
+        vals = line[:-1].split('\t')
+
+        if vals[0] == 'run' and len(vals) == 5:
+            if vals[3] != configs['tool'] or vals[4] != configs['year']:
+                err('The journal is from a run of {0} on year {1}'
+                    .format(vals[3], vals[4]))
+
+            configs['run-id'] = vals[1]
+            configs['started_at'] = vals[2]
+            got_header = True
+        elif vals[0] == 'queued' and len(vals) == 3:
+            queued.append((vals[1], vals[2]))
+        elif vals[0] == 'finished' and len(vals) == 4:
+            key = (vals[1], vals[2])
+            finished[key] = finished.get(key, 0) + 1
+        elif vals[0] in ['started', 'requeued']:
+            # the benchmarks that started but did not
+            # finish will be run again
+            continue
+        else:
+            err('Malformed line {0} in journal {1}'.format(num + 1, path))
+
+    f.close()
+
+    if not got_header:
+        err('Journal {0} has no header'.format(path))
+
+    done = 0
+    for bench in queued:
+        if finished.get(bench, 0) > 0:
+            finished[bench] -= 1
+            done += 1
+        else:
+            queue.add(bench)
+
+    return done
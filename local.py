@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Run benchmarks on this computer without ssh. Every benchmark is a child
+# process with its own limits on cpu time (timeout) and memory (memlimit).
+# When cgroup v2 is available, every benchmark runs in its own cgroup
+# and we take the cpu time and peak memory of the whole process tree from
+# it, otherwise we take them from the resource usage of the child.
+# The measured values go directly into RunningTask.time and .memory.
+
+import os
+import time
+import errno
+import signal
+import atexit
+import resource
+import threading
+import multiprocessing
+
+from common import err, dbg
+from configs import configs
+import subprocess
+
+from tasks import Task, new_pidfile, kill_script
+from dispatcher import RunningTask, RunningBatch
+
+# the cgroup that contains cgroups of the benchmarks
+_cgroup_root = None
+_cgroup_num = 0
+
+def _read_file(path):
+    f = open(path, 'r')
+    data = f.read()
+    f.close()
+
+    return data
+
+def _write_file(path, data):
+    f = open(path, 'w')
+    f.write(data)
+    f.close()
+
+def _cgroup2_dir():
+    """ Return the directory of our cgroup v2 or None """
+    mount = None
+    try:
+        for line in open('/proc/mounts'):
+            vals = line.split()
+            if vals[2] == 'cgroup2':
+                mount = vals[1]
+                break
+
+        if mount is None:
+            return None
+
+        for line in open('/proc/self/cgroup'):
+            # cgroup v2 has the line 0::/path
+            if line.startswith('0::'):
+                return (mount + line[3:].strip()).rstrip('/')
+    except IOError:
+        pass
+
+    return None
+
+def _remove_cgroup_root():
+    try:
+        os.rmdir(_cgroup_root)
+    except OSError as e:
+        dbg('Failed removing cgroup {0}: {1}'.format(_cgroup_root, e.strerror))
+
+def init_cgroups():
+    """
+    Create the cgroup for benchmarks and return True on success.
+    Our own cgroup contains satt, so we can not enable controllers in it,
+    but we can in the new empty one.
+    """
+    global _cgroup_root
+
+    d = _cgroup2_dir()
+    if d is None:
+        dbg('No cgroup v2, taking resource usage of the processes')
+        return False
+
+    root = '{0}/satt-{1}'.format(d, os.getpid())
+    try:
+        os.mkdir(root)
+    except OSError as e:
+        dbg('Failed creating cgroup {0}: {1}'.format(root, e.strerror))
+        return False
+
+    _cgroup_root = root
+    atexit.register(_remove_cgroup_root)
+
+    # we want memory.peak and memory.max, but we can
+    # live without them if the controller is not delegated to us
+    try:
+        _write_file('{0}/cgroup.subtree_control'.format(root), '+memory')
+    except IOError as e:
+        dbg('Failed enabling memory controller: {0}'.format(e.strerror))
+
+    return True
+
+class Cgroup(object):
+    """ cgroup of one benchmark """
+
+    def __init__(self):
+        global _cgroup_num
+
+        _cgroup_num += 1
+        self.path = '{0}/b{1}'.format(_cgroup_root, _cgroup_num)
+        os.mkdir(self.path)
+
+    def setMemoryLimit(self, limit):
+        try:
+            _write_file('{0}/memory.max'.format(self.path), str(limit))
+        except IOError:
+            # no memory controller, there is still the rlimit
+            pass
+
+    def join(self):
+        """ Move the calling process into the cgroup """
+        _write_file('{0}/cgroup.procs'.format(self.path), str(os.getpid()))
+
+    def _pids(self):
+        try:
+            data = _read_file('{0}/cgroup.procs'.format(self.path))
+        except IOError:
+            return []
+
+        return [int(p) for p in data.split()]
+
+    def cpuTime(self):
+        """ Return cpu time of all processes in the cgroup in seconds """
+        for line in _read_file('{0}/cpu.stat'.format(self.path)).split('\n'):
+            if line.startswith('usage_usec '):
+                return int(line.split()[1]) / 1000000.0
+
+        return None
+
+    def peakMemory(self):
+        """ Return the peak memory usage in bytes or None """
+        try:
+            return int(_read_file('{0}/memory.peak'.format(self.path)))
+        except (IOError, ValueError):
+            return None
+
+    def remove(self):
+        # kill what is left (processes that went into background)
+        try:
+            _write_file('{0}/cgroup.kill'.format(self.path), '1')
+        except IOError:
+            # no cgroup.kill (linux < 5.14)
+            for pid in self._pids():
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+        # the cgroup can not be removed until the killed processes exit
+        for i in range(100):
+            if not self._pids():
+                break
+            time.sleep(0.01)
+
+        try:
+            os.rmdir(self.path)
+        except OSError as e:
+            dbg('Failed removing cgroup {0}: {1}'.format(self.path, e.strerror))
+
+def _limits():
+    """ Return (cpu time in seconds, memory in bytes) limits or None """
+    try:
+        if configs.has_key('timeout'):
+            cpu = int(configs['timeout'])
+        else:
+            cpu = None
+
+        if configs.has_key('memlimit'):
+            mem = int(configs['memlimit']) * 1024 * 1024
+        else:
+            mem = None
+    except ValueError:
+        err('Invalid timeout or memlimit')
+
+    return (cpu, mem)
+
+class LocalRunningTask(RunningTask):
+    """ Benchmark running on this computer """
+
+    def __init__(self, cmd, proc, task, name, cat, cgroup):
+        RunningTask.__init__(self, cmd, proc, task, name, cat)
+        self._cgroup = cgroup
+        self._waited = False
+        # the reader thread of threaded dispatcher waits too
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """ Wait for the process and take its resource usage """
+        self._lock.acquire()
+        try:
+            return self._wait()
+        finally:
+            self._lock.release()
+
+    def _wait(self):
+        if self._waited:
+            return self.proc.returncode
+
+        while True:
+            try:
+                pid, status, rusage = os.wait4(self.proc.pid, 0)
+                break
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+
+        self._waited = True
+        # we reaped the process, so Popen must not do it again
+        if os.WIFSIGNALED(status):
+            self.proc.returncode = -os.WTERMSIG(status)
+        else:
+            self.proc.returncode = os.WEXITSTATUS(status)
+
+        self.time = rusage.ru_utime + rusage.ru_stime
+        # ru_maxrss is in kB
+        self.memory = rusage.ru_maxrss * 1024
+
+        if self._cgroup:
+            # this counts also the processes that are gone
+            # before their parent waited for them
+            tm = self._cgroup.cpuTime()
+            if not tm is None:
+                self.time = tm
+            mem = self._cgroup.peakMemory()
+            if not mem is None:
+                self.memory = mem
+
+            self._cgroup.remove()
+
+        return self.proc.returncode
+
+    def finish(self):
+        self.wait()
+        return RunningTask.finish(self)
+
+class LocalTask(Task):
+    """ Run benchmarks on this computer """
+
+    def __init__(self, parallel_no = 0):
+        if parallel_no <= 0:
+            parallel_no = multiprocessing.cpu_count()
+
+        Task.__init__(self, 'localhost', parallel_no)
+
+        self._use_cgroups = init_cgroups()
+
+    def _preexec(self, limits, cgroup):
+        cpu, mem = limits
+
+        def setup():
+            # if it fails, Popen raises the error in the parent
+            # (the cgroup would say the benchmark used nothing)
+            if cgroup:
+                cgroup.join()
+
+            # SIGXCPU on the limit, SIGKILL a bit later
+            # if the process ignores it
+            if not cpu is None:
+                resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 5))
+            if not mem is None:
+                resource.setrlimit(resource.RLIMIT_AS, (mem, mem))
+
+        return setup
+
+    def killProcesses(self, pidfile):
+        # the command may have left our process group
+        return subprocess.Popen(['sh', '-c', kill_script(pidfile)],
+                                stdout = subprocess.PIPE,
+                                stderr = subprocess.STDOUT)
+
+    def runBenchmark(self, cmd, bench):
+        name, cat = bench
+        limits = _limits()
+        pidfile = new_pidfile(cmd)
+
+        cgroup = None
+        if self._use_cgroups:
+            cgroup = Cgroup()
+            if not limits[1] is None:
+                cgroup.setMemoryLimit(limits[1])
+
+        ecmd = self.expandSpecialVariables(cmd, name, cat, pidfile)
+        try:
+            p = self._run(ecmd, self._preexec(limits, cgroup))
+        except IOError as e:
+            if cgroup is None:
+                raise
+
+            # run it without the cgroup, the resource usage
+            # of the process is better than nothing
+            dbg('Failed moving benchmark to cgroup {0}: {1}'
+                .format(cgroup.path, e.strerror))
+            cgroup.remove()
+            cgroup = None
+            p = self._run(ecmd, self._preexec(limits, None))
+
+        rb = LocalRunningTask(cmd, p, self, name, cat, cgroup)
+        rb.pidfile = pidfile
+
+        return rb
+
+    def runBatch(self, cmd, benches):
+        # the batch shares the limits, so give it the cpu time
+        # for all the benchmarks. We can not tell the resources
+        # of the benchmarks from the batch, so they are left on the
+        # command (as with remote machines)
+        cpu, mem = _limits()
+        if not cpu is None:
+            cpu *= len(benches)
+
+        names = [b[0] for b in benches]
+        cat = benches[0][1]
+        pidfile = new_pidfile(cmd)
+
+        p = self._run(self.expandSpecialVariables(cmd, ' '.join(names),
+                                                  cat, pidfile),
+                      self._preexec((cpu, mem), None))
+
+        rb = RunningBatch(cmd, p, self, names, cat)
+        rb.pidfile = pidfile
+
+        return rb
@@ -27,11 +27,12 @@
 # On arran we have only python2, so use python2
 
 import os
+import atexit
 from time import time, strftime, strptime
 
 import configs
 
-from common import err, dbg
+from common import err, dbg, colored
 from dispatcher import RunningTask
 from log import satt_log
 
@@ -65,11 +66,33 @@ def get_correct_result_from_name(name, true_spec, false_spec):
         return None
 
 
+# reporters that hold results, they store them when we exit
+# (unless they are closed before)
+_open_reporters = []
+
+def _store_at_exit():
+    for rep in list(_open_reporters):
+        rep._storeAtExit()
+
+def _keep_open(rep):
+    # registered with the first reporter, so that it runs
+    # before the log is closed
+    if not _open_reporters:
+        atexit.register(_store_at_exit)
+
+    _open_reporters.append(rep)
+
+def _forget(rep):
+    if rep in _open_reporters:
+        _open_reporters.remove(rep)
+
 class BenchmarkReport(object):
     """ Report results of benchmark. This is a abstract class """
 
     def __init__(self):
         self._progress = 0
+        # called with the benchmark when its result is stored
+        self._on_stored = None
 
         self._keywords = {
             'reach'     : (['true-unreach-call'], ['false-unreach-call']),
@@ -112,10 +135,13 @@ class BenchmarkReport(object):
         \param msg      one line of the output of the benchmark
         \param rb       instance of RunningBenchmark
         """
-        mach = rb.task.getMachine()
-        name = rb.name
         s = msg.strip()
 
+        if rb.isBatch():
+            rb = self._route(rb, s)
+            if rb is None:
+                return
+
         if self._changeState(rb, s):
             return
 
@@ -134,14 +160,60 @@ class BenchmarkReport(object):
         elif rb._state == 'WITNESS OUTPUT':
             self.witnessOutput(rb, s);
 
+    def _route(self, batch, s):
+        """
+        Return RunningTask from the batch that the line belongs to,
+        or None if the line was the tag of a benchmark
+        """
+        if s == '=== BENCHMARK':
+            batch._state = 'BENCHMARK'
+            return None
+        elif batch._state == 'BENCHMARK':
+            batch.switchTo(s)
+            batch._state = None
+            return None
+
+        # output that does not belong to any benchmark
+        if batch.current is None:
+            return batch
+
+        return batch.current
+
     def summary(self):
         "Give summary of the run"
         pass
 
+    def tick(self):
+        " Called once in a while, even if no benchmark finished "
+        pass
+
+    def flush(self):
+        " Store the results that are not stored yet "
+        pass
+
+    def close(self):
+        " Store the results and free what the reporter holds "
+        pass
+
+    def backlogged(self):
+        " Are the results stored slower than they come? "
+        return False
+
     def done(self, rb):
         " The benchmark is done"
         raise NotImplementedError("Child class needs to override this method")
 
+    def onStored(self, fn):
+        """
+        Call fn(rb) when the result of rb is stored, that may be later
+        than done() returns (fn may be called from another thread)
+        """
+        self._on_stored = fn
+
+    def _stored(self, rb):
+        if not self._on_stored is None:
+            self._on_stored(rb)
+
     def progress(self, progress):
         self._progress = progress
 
@@ -278,6 +350,7 @@ class StdoutReporter(BenchmarkReport):
         if rb.result is None:
             return False
 
+        self._stored(rb)
         return True
     def summary(self):
         incorrect_results_num = self._incorrect_false_results_num + self._incorrect_true_results_num
@@ -299,6 +372,59 @@ class StdoutReporter(BenchmarkReport):
                 satt_log("   -- {0}".format(b))
         satt_log("-----------------------------------------------------------------------")
 
+class SpoolReporter(BenchmarkReport):
+    """ Report results to stdout and store them into a spool """
+    def __init__(self, spool):
+        BenchmarkReport.__init__(self)
+
+        self._stdout = StdoutReporter()
+        self._spool = spool
+
+        _keep_open(self)
+
+    def progress(self, progress):
+        self._stdout.progress(progress)
+
+    def done(self, rb):
+        if not self._stdout.done(rb):
+            return False
+
+        self._spool.write(rb)
+        self._stored(rb)
+        return True
+
+    def tick(self):
+        self._spool.tick()
+
+    def flush(self):
+        self._spool.sync()
+
+    def _storeAtExit(self):
+        self._spool.sync()
+
+    def close(self):
+        _forget(self)
+        self._spool.close()
+
+def create_reporter():
+    """ Create the reporter given by configs """
+    if configs.configs['no-db'] == 'yes':
+        return StdoutReporter()
+
+    from spool import Spool, default_spool_path
+    if configs.configs.has_key('spool'):
+        return SpoolReporter(Spool(configs.configs['spool']))
+
+    from database import DatabaseUnreachable
+    spool = Spool(default_spool_path())
+    try:
+        return MysqlReporter(spool)
+    except DatabaseUnreachable as e:
+        satt_log(colored('WARN: Can not connect to the database ({0}), '
+                         'storing results to {1}'.format(e, spool.path),
+                         'red'))
+        return SpoolReporter(spool)
+
 def no_witness_categ(categ):
     # we're missing the Termination and Concurrency
     return categ.endswith('-Arrays') or\
@@ -312,7 +438,7 @@ class RatingMethod(object):
                          'true_correct, true_incorrect '
                          'FROM rating_methods INNER JOIN years '
                          'ON rating_methods.year_id = years.id '
-                         'WHERE year = \'{0}\';'.format(configs.configs['year']))
+                         'WHERE year = %s;', [configs.configs['year']])
         if not res:
             err('Failed getting rating methods')
 
@@ -354,12 +480,6 @@ def None2Zero(x):
         return 0
     return x
 
-def Empty2Null(x):
-    if x == '':
-        return 'NULL'
-
-    return '\'{0}\''.format(x.strip())
-
 def is_correct(res1, res2):
     if res1 is None or res2 is None:
         return 0
@@ -372,31 +492,179 @@ def is_correct(res1, res2):
 def get_name(name):
     return os.path.basename(name)
 
+class IdCache(object):
+    """
+    Ids of years, tools, categories and tasks. They do not change
+    during the run, so we load them once and then ask the db only
+    for the rows that we do not know (and remember them)
+    """
+
+    def __init__(self, query_func, year):
+        self._query = query_func
+
+        res = self._query('SELECT id FROM years WHERE year = %s;', [year])
+        if not res:
+            err('Do not have year {0}. If this is not typo, '
+                'update the database and benchmarks'.format(year))
+
+        self.year_id = res[0][0]
+
+        # version -> id, the other attributes of the tool are fixed
+        self._tools = dict()
+        # name -> (id, name)
+        self._categories = dict()
+        # (category id, task name) -> (id, correct_result)
+        self._tasks = dict()
+
+        res = self._query("""
+        SELECT id, name FROM categories WHERE year_id = %s;
+        """, [self.year_id])
+        for r in res:
+            self._categories[r[1]] = (r[0], r[1])
+
+        res = self._query("""
+        SELECT tasks.id, tasks.correct_result, tasks.category_id, tasks.name
+        FROM tasks INNER JOIN categories ON tasks.category_id = categories.id
+        WHERE categories.year_id = %s;
+        """, [self.year_id])
+        for r in res:
+            self._tasks[(r[2], r[3])] = (r[0], r[1])
+
+        dbg('Loaded ids of {0} categories and {1} tasks'
+            .format(len(self._categories), len(self._tasks)))
+
+    def tool(self, version):
+        return self._tools.get(version)
+
+    def addTool(self, version, tool_id):
+        self._tools[version] = tool_id
+
+    def category(self, name, ask_db = True):
+        """
+        Return (id, name) of the category or None. Without ask_db,
+        return None if it is not in the cache
+        """
+        if self._categories.has_key(name):
+            return self._categories[name]
+        elif not ask_db:
+            return None
+
+        # the db may compare the names differently than we do
+        # or somebody may have added the category
+        res = self._query("""
+        SELECT id, name FROM categories
+        WHERE
+            year_id = %s and name = %s;
+        """, [self.year_id, name])
+        if not res:
+            return None
+
+        assert len(res) == 1
+        self.addCategory(name, res[0])
+        return self._categories[name]
+
+    def addCategory(self, name, row):
+        self._categories[name] = (row[0], row[1])
+
+    def task(self, cat_id, name, ask_db = True):
+        """ Return (id, correct_result) of the task or None """
+        key = (cat_id, name)
+        if self._tasks.has_key(key):
+            return self._tasks[key]
+        elif not ask_db:
+            return None
+
+        res = self._query("""
+        SELECT id, correct_result FROM tasks
+        WHERE name = %s and category_id = %s;
+        """, [name, cat_id])
+        if not res:
+            return None
+
+        assert len(res) == 1
+        self.addTask(cat_id, name, res[0])
+        return self._tasks[key]
+
+    def addTask(self, cat_id, name, row):
+        self._tasks[(cat_id, name)] = (row[0], row[1])
+
+# results of the run for the e-mail, from the summaries
+# that the db writer keeps (db-cli explain checks them)
+RUN_RESULTS_QUERY = """
+        SELECT result, is_correct, witness, SUM(num_results)
+            FROM run_summaries
+            WHERE run_id = %s
+            GROUP BY result, is_correct, witness"""
+
+RUN_TOOL_QUERY = """SELECT tool_id FROM run_summaries
+               WHERE run_id = %s LIMIT 1"""
+
 class MysqlReporter(BenchmarkReport):
-    def __init__(self):
+    def __init__(self, spool = None):
+        """
+        If spool is given, the results are stored into it
+        when the database becomes unreachable
+        """
         BenchmarkReport.__init__(self)
 
         # use this to print out what is happening
         self._stdout = StdoutReporter()
-        self.run_id = int(time())
+        self.run_id = int(configs.configs['run-id'])
         self.tool_params = '{0}'.format(configs.configs['params'])
 
-        # replace apostrophes in tool_params
-        self.tool_params = self.tool_params.replace('\'', '\\\'')
-
         from database import DatabaseConnection
-        self._db = DatabaseConnection()
+        self._spool = spool
+        self._offline = False
+        self._db = DatabaseConnection(raise_unreachable = not spool is None)
 
         ver = self._db.query('SELECT VERSION()')[0][0]
         satt_log('Connected to database: MySQL version {0}'.format(ver))
 
+        # the results are stored into tables and columns that
+        # the migrations add, storing them would fail in the middle
+        from schema import pending_migrations
+        pending = pending_migrations(self._db)
+        if pending:
+            err('The database is not up to date (missing migrations {0}), '
+                'run ./db-cli migrate'
+                .format(', '.join([str(m[0]) for m in pending])))
+
         self._rating_methods = RatingMethod(self._db.query)
+        self._ids = IdCache(self._db.query, configs.configs['year'])
+
+        from resolver import Resolver
+        self._resolver = Resolver(self._db)
+
+        # results are stored by more at once by the writer
+        # that has its own connection
+        try:
+            batch = int(configs.configs['db-flush-results'])
+            interval = float(configs.configs['db-flush-interval'])
+            size = int(configs.configs['db-queue-size'])
+        except ValueError:
+            err('Invalid db-flush-results, db-flush-interval or db-queue-size')
+
+        # the journal records the results when the writer commits them
+        from dbwriter import DbWriter
+        ignore = configs.configs['ignore-duplicates'] == 'yes'
+        self._writer = DbWriter(batch, interval, size, spool, self._stored,
+                                ignore)
+        self._writer.start()
+
+        # (row, tool_id, task_id, benchmark) that did not fit
+        # into the writer's queue
+        self._overflow = []
+
+        # do not lose the results if we exit on error
+        _keep_open(self)
 
     def progress(self, progress):
         # we must redirect progress to stdout
         self._stdout.progress(progress)
 
     def _commit(self):
+        # the writer inserts the results from another connection,
+        # it must see the new tools, categories and tasks
         self._db.commit()
 
     def _updateDb(self, rb):
@@ -407,39 +675,19 @@ class MysqlReporter(BenchmarkReport):
                 return configs.configs['tool']
 
         ver = rb.versions.strip()
+        year_id = self._ids.year_id
 
-        q = """
-        SELECT id FROM years WHERE year = '{0}';
-        """.format(configs.configs['year']);
-        res = self._db.query(q)
-        if not res:
-            err('Do not have year {0}. If this is not typo, '
-                'update the database and benchmarks'.format(configs.configs['year']))
-
-        year_id = res[0][0]
+        tool_id = self._ids.tool(ver)
+        if not tool_id is None:
+            return tool_id, year_id
 
         # If tool that runs in this run is not known to database, add it
-        q = """
-        SELECT id FROM tools
-        WHERE name = '{0}' and version = '{1}'
-              and params = '{2}' and year_id = '{3}';
-        """.format(configs.configs['tool'], ver, self.tool_params, year_id)
-        res = self._db.query(q)
-        if not res:
-            q2 = """
-            INSERT INTO tools
-            (name, year_id, version, params, tag, note)
-            VALUES('{0}', '{1}', '{2}', '{3}', '{4}', {5});
-            """.format(configs.configs['tool'], year_id,
-                       ver, self.tool_params, choose_tag(),
-                       Empty2Null(configs.configs['note']))
-            self._db.query(q2)
-
-            # get new tool_id
-            res = self._db.query(q)
-            assert len(res) == 1
-
-        tool_id = res[0][0]
+        note = configs.configs['note'].strip()
+        tool_id = self._resolver.tool(configs.configs['tool'], ver,
+                                      self.tool_params, year_id,
+                                      choose_tag(), note or None)
+        self._commit()
+        self._ids.addTool(ver, tool_id)
 
         return tool_id, year_id
 
@@ -453,38 +701,22 @@ class MysqlReporter(BenchmarkReport):
             satt_log(msg)
             rb.output += msg
             rb.result = 'unknown ({0})'.format(rb.result)
-        # create new task
-        q = """
-        INSERT INTO tasks
-          (name, category_id, correct_result, property)
-          VALUES('{0}', '{1}', '{2}', '{3}');
-        """.format(name, cat_id, cr, None)
-        self._db.query(q)
-
-        q = """
-        SELECT id, correct_result FROM tasks
-        WHERE name = '{0}' and category_id = '{1}';
-        """.format(name, cat_id)
-        return self._db.query(q)
+
+        # create new task (if nobody created it meanwhile)
+        task_id = self._resolver.task(cat_id, name, cr)
+        self._commit()
+        self._ids.addTask(cat_id, name, (task_id, cr))
+
+        return (task_id, cr)
 
     def update_category(self, year_id, name):
         """ Create new category in the database """
 
-        # create the a category in the database
-        q = """
-        INSERT INTO categories
-          (year_id, name) VALUES ('{0}', '{1}');
-        """.format(year_id, name)
-        self._db.query(q)
-
-        # return the new result
-        q = """
-        SELECT id, name FROM categories
-        WHERE
-            year_id = '{0}' and name = '{1}';
-        """.format(year_id, name)
+        cat_id = self._resolver.category(year_id, name)
+        self._commit()
+        self._ids.addCategory(name, (cat_id, name))
 
-        return self._db.query(q)
+        return (cat_id, name)
 
     def done(self, rb):
         # print it after saving
@@ -493,59 +725,62 @@ class MysqlReporter(BenchmarkReport):
             # proceed further
             return False
 
+        if self._offline or self._writer.offline:
+            self._spool.write(rb)
+            self._stored(rb)
+            return True
+
+        from database import DatabaseUnreachable
+        try:
+            return self.store(rb)
+        except DatabaseUnreachable as e:
+            satt_log(colored('WARN: Lost connection to the database ({0}), '
+                             'storing results to {1}'
+                             .format(e, self._spool.path), 'red'))
+            self._offline = True
+            self._spool.write(rb)
+            self._stored(rb)
+            return True
+
+    def store(self, rb):
+        """ Store the result of the benchmark into the database """
         tool_id, year_id = self._updateDb(rb)
 
-        q = """
-        SELECT id, name FROM categories
-        WHERE
-            year_id = '{0}' and name = '{1}';
-        """.format(year_id, rb.category)
-        res = self._db.query(q)
-        if not res:
-            if configs.configs['save-new-tasks'] == 'yes':
+        # unknown categories and tasks are created (if they are not
+        # in the db) by one query, we do not need to look for them
+        save_new = configs.configs['save-new-tasks'] == 'yes'
+
+        res = self._ids.category(rb.category, not save_new)
+        if res is None:
+            if save_new:
                 res = self.update_category(year_id, rb.category)
             else:
                 rb.dumpToFile('Do not have given category')
                 satt_log('^^ dumped to file (unknown category)')
+                self._stored(rb)
                 return True
 
-        assert len(res) == 1
-        if not len(res[0]) == 2:
-            print(res[0])
-        assert len(res[0]) == 2
-        cat_id = res[0][0]
-        cat_name = res[0][1]
+        cat_id, cat_name = res
 
-        q = """
-        SELECT id, correct_result FROM tasks
-        WHERE name = '{0}' and category_id = '{1}';
-        """.format(get_name(rb.name), cat_id)
-        res = self._db.query(q)
+        res = self._ids.task(cat_id, get_name(rb.name), not save_new)
 
         # we do not have such a task??
-        if not res:
-            if configs.configs['save-new-tasks'] == 'yes':
+        if res is None:
+            if save_new:
                 res = self.save_task(rb, cat_id)
             else:
                 rb.dumpToFile('Do not have given task')
                 satt_log('^^ dumped to file (unknown task)')
+                self._stored(rb)
                 return True
 
-        assert len(res) == 1
-        task_id = res[0][0]
-        correct_result = res[0][1]
+        task_id, correct_result = res
 
-        # replace ' by \' in output
-        rb.output = rb.output.replace('\'', '\\\'')
         ic = is_correct(correct_result, rb.result)
 
         result= rb.result.lower()
         if rb.witness != '':
             wtns = rb.witness.strip()
-
-            # replace ' even in witness, because it can contain
-            # arbitrary text
-            wtns = wtns.replace('\'', '\\\'')
         else:
             wtns = None
 
@@ -553,45 +788,78 @@ class MysqlReporter(BenchmarkReport):
             # FIXME we should limit the wintess_output size, otherwise we
             # get get some performance issues
             rb.witness_output = rb.witness_output.strip()
-            rb.witness_output = rb.witness_output.replace('\'', '\\\'')
 
-        q = """
-        INSERT INTO task_results
-        (tool_id, task_id, result, witness, is_correct, points, cpu_time,
-         memory_usage, output, witness_output, run_id)
-        VALUES('{0}', '{1}', '{2}', '{3}', '{4}', '{5}', '{6}', '{7}', {8}, '{9}', '{10}')
-        """.format(tool_id, task_id, result, wtns, ic,
-                   self._rating_methods.points(ic, rb.result, wtns, cat_name), None2Zero(rb.time),
-                   None2Zero(rb.memory), Empty2Null(rb.output), rb.witness_output, self.run_id)
+        if rb.output == '':
+            output = None
+        else:
+            output = rb.output.strip()
 
-        def _exception_handler(args, data):
-            q, tool_id, task_id = data
+        # the values are escaped by executemany. Witness has been
+        # always stored as a string (also 'None')
+        row = (tool_id, task_id, result, str(wtns), ic,
+               self._rating_methods.points(ic, rb.result, wtns, cat_name),
+               None2Zero(rb.time), None2Zero(rb.memory), output,
+               rb.witness_output, self.run_id)
 
-            if (args[1].startswith('Duplicate entry')):
+        self._writer.check()
+        self._drain()
 
-                if configs.configs['ignore-duplicates'] == 'yes':
-                    satt_log('Already has this result for this tool, ignoring.')
-                else:
-                    err('Already has result of this benchmark for this tool.\n'
-                        'It is only supported to have one result for each '
-                        'benchmark and particular tool\n'
-                        'If want ignore this behaviour use --ignore-duplicates.\n'
-                        '(tool + version + params). You can delete the old result:\n'
-                        '  $ ./db-cli \'DELETE from task_results WHERE tool_id={0}'
-                        ' and task_id={1}\'\n'
-                        'or you can delete all results for this tool:\n'
-                        '  $ ./db-cli \'DELETE from tools WHERE id={0}\'\n'
-                        .format(tool_id, task_id, tool_id))
-            else:
-                err('Failed querying db: {0}\n\n{1}'.format(args[1], q))
+        item = (row, tool_id, task_id, rb, cat_id)
+        if self._overflow or not self._writer.put(item):
+            self._overflow.append(item)
 
-        self._db.query_with_exception_handler(q, _exception_handler,
-                                              (q, tool_id, task_id))
+        return True
 
-        self._commit()
+    def _drain(self):
+        """ Move the results we kept into the writer's queue """
+        while self._overflow:
+            if not self._writer.put(self._overflow[0]):
+                return
 
-        return True
+            self._overflow.pop(0)
+
+    def backlogged(self):
+        return len(self._overflow) > 0
+
+    def tick(self):
+        self._writer.check()
+        self._drain()
 
+        if not self._spool is None:
+            self._spool.tick()
+
+    def flush(self):
+        """ Store all results, wait until they are stored """
+        self._writer.check()
+
+        for item in self._overflow:
+            self._writer.put(item, block = True)
+        self._overflow = []
+
+        self._writer.flush()
+        self._writer.check()
+
+        if not self._spool is None:
+            self._spool.sync()
+
+    def _storeAtExit(self):
+        try:
+            # if the writer failed, we are exiting because of it
+            if not self._writer.failed():
+                self.flush()
+        finally:
+            # it would wake up while python is shutting down
+            self._writer.stop()
+
+    def close(self):
+        """ Store the results, stop the writer and close the connections """
+        _forget(self)
+        try:
+            self._storeAtExit()
+        finally:
+            self._db.close()
+            if not self._spool is None:
+                self._spool.close()
 
     def sendEmail(self, server, from_addr, to_addrs):
         import smtplib
@@ -621,13 +889,7 @@ Results:
            configs.configs['year'],
            configs.configs['note'])
 
-        q = """
-        SELECT result, is_correct, witness, count(*)
-            FROM task_results
-            WHERE run_id = {0}
-            GROUP BY result, is_correct, witness""".format(self.run_id)
-
-        res = self._db.query(q)
+        res = self._db.query(RUN_RESULTS_QUERY, [self.run_id])
         if not res:
             err('No results stored to db after this run?')
 
@@ -649,9 +911,7 @@ Results:
 
         text += '\nTotal number of benchmarks: {0}'.format(total)
 
-        q = """SELECT tool_id FROM task_results
-               WHERE run_id = {0}""".format(self.run_id)
-        res = self._db.query(q)
+        res = self._db.query(RUN_TOOL_QUERY, [self.run_id])
         if not res:
             err('Failed querying db for tool\'s id')
 
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Ids of years, categories, tools and tasks. The rows are inserted
+# if they are not in the database yet and the id is returned by one
+# query (see DatabaseConnection.upsert), so more satts can add the same
+# tool or task at once. It relies on the unique keys of the tables
+# (database/migrations/001_unique_keys.sql).
+
+import hashlib
+
+def tool_fingerprint(name, version, params, year_id):
+    """
+    Tools are identified by name, version, params and year, but the
+    columns are too long for a unique key. The key is on the hash of them
+    (computed in the same way in the migration)
+    """
+    def _str(v):
+        if v is None:
+            return ''
+        elif isinstance(v, unicode):
+            # MySQL hashes the utf8 string
+            return v.encode('utf-8')
+
+        return str(v)
+
+    data = '\x1f'.join([_str(v) for v in [name, version, params, year_id]])
+
+    return hashlib.sha1(data).hexdigest()
+
+class Resolver(object):
+    def __init__(self, db):
+        self._db = db
+
+    def year(self, year, created_at = None):
+        return self._db.upsert('years', ['year', 'created_at', 'updated_at'],
+                               [year, created_at, created_at], ['year'])
+
+    def category(self, year_id, name, created_at = None):
+        cols = ['year_id', 'name']
+        row = [year_id, name]
+        if not created_at is None:
+            cols.append('created_at')
+            row.append(created_at)
+
+        return self._db.upsert('categories', cols, row, ['year_id', 'name'])
+
+    def tool(self, name, version, params, year_id, tag = None, note = None,
+             created_at = None):
+        cols = ['name', 'version', 'params', 'year_id', 'tag', 'note',
+                'fingerprint']
+        row = [name, version, params, year_id, tag, note,
+               tool_fingerprint(name, version, params, year_id)]
+        if not created_at is None:
+            cols.append('created_at')
+            row.append(created_at)
+
+        return self._db.upsert('tools', cols, row, ['fingerprint'])
+
+    def task(self, category_id, name, correct_result, prop = None,
+             created_at = None):
+        cols = ['category_id', 'name', 'correct_result', 'property']
+        row = [category_id, name, correct_result, prop]
+        if not created_at is None:
+            cols.append('created_at')
+            row.append(created_at)
+
+        return self._db.upsert('tasks', cols, row, ['name', 'category_id'])
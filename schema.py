@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+
+# Changes of the database schema. Every file in database/migrations
+# is one migration (NNN_name.sql for MySQL, NNN_name.sqlite.sql for
+# sqlite), they are applied in the order of their names and the applied
+# ones are recorded in the schema_migrations table (as Rails does it).
+# New sqlite files have them all (database/sqlite.sql).
+#
+# explain() shows how the database runs a query, so that we can check
+# that the queries of satt do not read whole tables of results.
+
+import os
+import re
+import json
+
+from database import SqliteStore
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'database', 'migrations')
+
+# tables that grow with the results, reading them whole is slow
+BIG_TABLES = ['task_results', 'tasks']
+
+def _is_sqlite(db):
+    return isinstance(db.backend(), SqliteStore)
+
+def _migrations(sqlite):
+    """ Return sorted list of (version, path) of the migration files """
+    if sqlite:
+        suffix = '.sqlite.sql'
+    else:
+        suffix = '.sql'
+
+    migs = []
+    for f in sorted(os.listdir(MIGRATIONS_DIR)):
+        if not f.endswith(suffix):
+            continue
+        if not sqlite and f.endswith('.sqlite.sql'):
+            continue
+
+        migs.append((f[:-len(suffix)], os.path.join(MIGRATIONS_DIR, f)))
+
+    return migs
+
+def applied_migrations(db):
+    # databases created from old database.sql or sqlite.sql
+    # may not have the table
+    db.execute('CREATE TABLE IF NOT EXISTS schema_migrations '
+               '(version varchar(255) NOT NULL UNIQUE);')
+    db.commit()
+
+    return set([r[0] for r in
+                db.query('SELECT version FROM schema_migrations;')])
+
+def pending_migrations(db):
+    """ Return list of (version, path) of migrations that were not applied """
+    done = applied_migrations(db)
+    return [m for m in _migrations(_is_sqlite(db)) if not m[0] in done]
+
+def _statements(text):
+    """ Split the file into statements (they end by ; at the end of line) """
+    lines = [l for l in text.splitlines() if not l.lstrip().startswith('--')]
+    stmts = re.split(';[ \t]*\n', '\n'.join(lines) + '\n')
+
+    return [s.strip() for s in stmts if s.strip()]
+
+def apply_migration(db, version, path):
+    """
+    Run the statements of the migration and record it. MySQL commits
+    every ALTER TABLE, so if a statement fails, the ones before it stay
+    applied and the migration must be finished by hand
+    """
+    f = open(path, 'r')
+    stmts = _statements(f.read())
+    f.close()
+
+    for s in stmts:
+        db.execute(s)
+
+    db.execute('INSERT INTO schema_migrations (version) VALUES (%s);',
+               [version])
+    db.commit()
+
+def _mysql_scans(plan, scans):
+    # the tables are somewhere in the nested objects
+    if isinstance(plan, dict):
+        if plan.get('access_type') == 'ALL':
+            scans.append(plan.get('table_name'))
+        for v in plan.values():
+            _mysql_scans(v, scans)
+    elif isinstance(plan, list):
+        for v in plan:
+            _mysql_scans(v, scans)
+
+def explain(db, q, params = None):
+    """
+    Return (plan, scans) for the query, plan is the list of lines
+    as the database describes it and scans are the tables that
+    it reads whole (not by an index)
+    """
+    scans = []
+    if _is_sqlite(db):
+        plan = [r[-1] for r in db.query('EXPLAIN QUERY PLAN ' + q, params)]
+        for p in plan:
+            # 'SCAN t', 'SCAN TABLE t' in older sqlite,
+            # 'SCAN t USING COVERING INDEX i' reads only the index
+            words = p.split()
+            if words[0] == 'SCAN' and not 'INDEX' in words:
+                if words[1] == 'TABLE':
+                    scans.append(words[2])
+                else:
+                    scans.append(words[1])
+    else:
+        res = db.query('EXPLAIN FORMAT=JSON ' + q, params)
+        plan = res[0][0].splitlines()
+        _mysql_scans(json.loads(res[0][0]), scans)
+
+    return plan, scans
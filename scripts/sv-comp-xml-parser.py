@@ -35,6 +35,25 @@ try:
 except ImportError:
     err('Do not have MySQLdb module')
 
+# use satt's resolver of ids
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+from database import MysqlStore
+from resolver import Resolver
+
+class ResolverDb(object):
+    """ Upserts for Resolver on the connection of the result """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._store = MysqlStore({})
+
+    def upsert(self, table, cols, row, key):
+        try:
+            return self._store.upsert(self._cursor, table, cols, row, key)
+        except db.Error as e:
+            err(str(e))
+
 def get_correct_result(name):
     """
     Returns 'true' or 'false' depending on what of these words
@@ -132,9 +151,9 @@ resources: {8}, {9} MB
     def dump(self):
         print(self.__str__())
 
-    def _db(self, query):
+    def _db(self, query, params = None):
         try:
-            self._cursor.execute(query)
+            self._cursor.execute(query, params)
             ret = self._cursor.fetchall()
         except db.Error as e:
             err(str(e))
@@ -146,107 +165,17 @@ resources: {8}, {9} MB
 
         assert self.check()
 
-        ###
-        # Update years table
-        ###
+        # every row is inserted or found by one query,
+        # the unique keys are in database/migrations
+        resolver = Resolver(ResolverDb(self._cursor))
 
-        # I don't want to catch exceptions and check if we have duplicate rows
-        # so just query the db and insert only if we do not have the row
-        q = 'SELECT count(id) FROM years WHERE year = {0}'.format(self.year)
-        res = self._db(q)
-        if res[0][0] == 0:
-            q = 'INSERT INTO years (year, created_at, updated_at) '\
-            'VALUES(\'{0}\', \'{1}\',\'{2}\');'.format(self.year, self.date, self.date)
-
-            # add year if we do not have this one
-            self._db(q)
-
-        res = self._db('SELECT id FROM years WHERE year = {0};'.format(self.year))
-        year_id = res[0][0]
-
-        ###
-        # Update categories table
-        ###
-
-        category_id = None
-
-        q = """
-        SELECT id FROM categories
-        WHERE name = '{0}' and year_id = {1};
-        """.format(self.category, year_id)
-        res = self._db(q)
-        if not res:
-            # add category if we do not have it
-            q2 = """
-            INSERT INTO categories (name, year_id, created_at)
-            VALUES('{0}', '{1}', '{2}');
-            """.format(self.category, year_id, self.date)
-            self._db(q2)
-
-            # get new category id
-            # XXX use executemany instead?
-            res = self._db(q)
-            assert len(res) == 1
-            category_id = res[0][0]
-
-        else:
-            assert len(res) == 1
-            category_id = res[0][0]
-
-        ###
-        # Update tools table
-        ###
-
-        tool_id = None
-
-        q = """
-        SELECT id FROM tools WHERE name = '{0}' and version = '{1}' and params = '{2}' and year_id = '{3}';
-        """.format(self.tool, self.version, self.params, year_id)
-        res = self._db(q)
-        # inconsistency in database (more rows for one version of a tool)
-        assert len(res) < 2
-
-        if not res:
-            # no tool of this name and version, add it!
-            q2 = """
-            INSERT INTO tools (name, year_id, version, params, created_at, tag)
-            VALUES('{0}', '{1}', '{2}', '{3}', '{4}', '{5}');
-            """.format(self.tool, year_id, self.version, self.params,
-                       self.date, 'svcomp')
-            self._db(q2)
-
-            res = self._db(q)
-            assert len(res) == 1
-            tool_id = res[0][0]
-
-        else:
-            tool_id = res[0][0]
-
-        ###
-        # Update tasks
-        ###
-        task_id = None
-        assert not category_id is None
-
-        q = """
-        SELECT id FROM tasks WHERE name = '{0}' and category_id = '{1}'
-        """.format(self.name, category_id)
-        res = self._db(q)
-        if res:
-            task_id = res[0][0]
-        else:
-            correct_result = get_correct_result(self.name)
-            q2 = """
-            INSERT INTO tasks
-            (name, category_id, correct_result, created_at)
-            VALUES('{0}', '{1}', '{2}', '{3}', '{4}');
-            """.format(self.name, category_id, correct_result,
-                       self.date, self.date);
-            self._db(q2)
-
-            res = self._db(q)
-            assert len(res) == 1
-            task_id = res[0][0]
+        year_id = resolver.year(self.year, self.date)
+        category_id = resolver.category(year_id, self.category, self.date)
+        tool_id = resolver.tool(self.tool, self.version, self.params, year_id,
+                                tag = 'svcomp', created_at = self.date)
+        task_id = resolver.task(category_id, self.name,
+                                get_correct_result(self.name),
+                                created_at = self.date)
 
         return (tool_id, task_id)
 
@@ -280,11 +209,11 @@ resources: {8}, {9} MB
         INSERT INTO task_results
         (tool_id, task_id, result, is_correct, points,
         cpu_time, memory_usage, created_at)
-        VALUES('{0}', '{1}', '{2}', '{3}', '{4}', '{5}', '{6}', '{7}');
-        """.format(tool_id, task_id, self.status, is_correct(self.correct),
-                   get_points(is_correct(self.correct), self.status),
-                   self.cpuTime, self.memUsage, self.date, self.date)
-        self._db(q)
+        VALUES(%s, %s, %s, %s, %s, %s, %s, %s);
+        """
+        self._db(q, [tool_id, task_id, self.status, is_correct(self.correct),
+                     get_points(is_correct(self.correct), self.status),
+                     self.cpuTime, self.memUsage, self.date])
 
     def commit(self):
         print('Commited: {0} - {1} - {2}'.format(self.tool, self.category, self.name))
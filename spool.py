@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Spool of results that we could not store into the database
+# (the server is down or we lost the connection during the run) or that
+# the user wants to store later (--spool). It is a file with one JSON
+# object per line, every run starts with a header:
+#
+#   {"run": {"tool": ..., "year": ..., "params": ..., "run-id": ...}}
+#   {"name": ..., "category": ..., "result": ..., "output": ..., ...}
+#   ...
+#
+# The lines are synced to the disk by batches (db-flush-results and
+# db-flush-interval). The results are stored into the database later by
+# 'db-cli replay spool', that looks up the tool, categories and tasks in
+# the same way as MysqlReporter does.
+
+import os
+import json
+import threading
+from time import time
+
+import configs
+
+from common import err
+from log import satt_log
+
+# configs that MysqlReporter uses, they are in the header of the run
+RUN_KEYS = ['tool', 'year', 'tool-tag', 'note', 'run-id', 'started_at',
+            'save-new-tasks']
+
+# attributes of RunningTask that are stored
+RESULT_KEYS = ['name', 'category', 'cmd', 'versions', 'result', 'witness',
+               'witness_output', 'output', 'time', 'memory']
+
+# the output of tools may be any bytes, json wants unicode
+ENCODING = 'latin-1'
+
+def default_spool_path():
+    return '{0}.{1}.spool'.format(configs.configs['tool'],
+                                  configs.configs['run-id'])
+
+def _decode(val):
+    if isinstance(val, unicode):
+        return val.encode(ENCODING)
+
+    return val
+
+class Spool(object):
+    """ Append-only file with results, it is created on the first write """
+
+    def __init__(self, path):
+        self.path = path
+
+        try:
+            self._batch = int(configs.configs['db-flush-results'])
+            self._interval = float(configs.configs['db-flush-interval'])
+        except ValueError:
+            err('Invalid db-flush-results or db-flush-interval')
+
+        self._header = dict()
+        for key in RUN_KEYS:
+            if configs.configs.has_key(key):
+                self._header[key] = configs.configs[key]
+        # the tool is stored with the params as a string
+        self._header['params'] = '{0}'.format(configs.configs['params'])
+
+        # the reporter and the db writer use the spool
+        self._lock = threading.Lock()
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time()
+        self.count = 0
+
+    def _open(self):
+        try:
+            self._file = open(self.path, 'a')
+        except IOError as e:
+            err('Failed opening spool {0}: {1}'.format(self.path, e.strerror))
+
+        satt_log('Storing results to {0}, store them to the database '
+                 'by: ./db-cli replay {0}'.format(self.path))
+        self._writeLine({'run' : self._header})
+
+    def _writeLine(self, obj):
+        self._file.write(json.dumps(obj, encoding = ENCODING))
+        self._file.write('\n')
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        self._unsynced = 0
+        self._last_sync = time()
+
+    def write(self, rb):
+        """ Append the result of the benchmark """
+        rec = dict()
+        for key in RESULT_KEYS:
+            rec[key] = getattr(rb, key)
+        rec['machine'] = rb.task.getMachine()
+
+        self._lock.acquire()
+        try:
+            if self._file is None:
+                self._open()
+
+            self._writeLine(rec)
+            self.count += 1
+            self._unsynced += 1
+
+            if self._unsynced >= self._batch or\
+               time() - self._last_sync >= self._interval:
+                self._sync()
+        finally:
+            self._lock.release()
+
+    def tick(self):
+        self._lock.acquire()
+        try:
+            if self._unsynced > 0 and\
+               time() - self._last_sync >= self._interval:
+                self._sync()
+        finally:
+            self._lock.release()
+
+    def sync(self):
+        self._lock.acquire()
+        try:
+            if self._unsynced > 0:
+                self._sync()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if not self._file is None:
+                self._sync()
+                self._file.close()
+                self._file = None
+        finally:
+            self._lock.release()
+
+def _spooled_benchmark(rec):
+    from dispatcher import RunningTask
+    from tasks import Task
+
+    rec = dict([(k, _decode(v)) for k, v in rec.items()])
+    rb = RunningTask(rec['cmd'], None, Task(rec['machine']),
+                     rec['name'], rec['category'])
+    for key in RESULT_KEYS:
+        setattr(rb, key, rec[key])
+
+    return rb
+
+def replay(path):
+    """ Store the results from the spool into the database """
+    from reporter import MysqlReporter
+
+    try:
+        f = open(path, 'r')
+    except IOError as e:
+        err('Failed opening spool {0}: {1}'.format(path, e.strerror))
+
+    report = None
+    stored = 0
+
+    for num, line in enumerate(f):
+        # the last line may be cut if we got killed while writing it
+        if not line.endswith('\n'):
+            satt_log('Ignoring cut line {0} of {1}'.format(num + 1, path))
+            break
+
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            err('Malformed line {0} in spool {1}'.format(num + 1, path))
+
+        if obj.has_key('run'):
+            if not report is None:
+                report.flush()
+
+            for key in RUN_KEYS:
+                if configs.configs.has_key(key):
+                    configs.configs.pop(key)
+            for key, val in obj['run'].items():
+                configs.configs[str(key)] = _decode(val)
+
+            satt_log('Storing results of run {0} of {1}'
+                     .format(configs.configs['run-id'],
+                             configs.configs['tool']))
+            report = MysqlReporter()
+        elif report is None:
+            err('Spool {0} has no header'.format(path))
+        else:
+            report.store(_spooled_benchmark(obj))
+            stored += 1
+
+    f.close()
+
+    if not report is None:
+        report.flush()
+
+    return stored
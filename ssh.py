@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Keep one master ssh connection per machine for the whole run,
+# so that we do not pay for the ssh handshake with every benchmark.
+# Every ssh that is run with ssh_options() (the {ssh-cmd} in cmd and
+# sync-cmd is extended with them) goes through the master connection.
+
+import os
+import atexit
+import shutil
+import subprocess
+import tempfile
+
+from common import dbg, colored
+from configs import configs
+from log import satt_log
+
+_control_dir = None
+_masters = []
+# the ssh binary, we extend configs['ssh-cmd'] by the options
+_ssh = None
+
+def _ssh_cmd():
+    if not _ssh is None:
+        return _ssh
+
+    if configs.has_key('ssh-cmd'):
+        return configs['ssh-cmd']
+
+    return 'ssh'
+
+def _control_path():
+    return '{0}/%r@%h:%p'.format(_control_dir)
+
+def ssh_destination(machine):
+    if configs['ssh-user']:
+        return '{0}@{1}'.format(configs['ssh-user'], machine)
+
+    return machine
+
+def ssh_options():
+    """ Options for ssh that make it reuse the master connection """
+    if _control_dir is None:
+        return []
+
+    return ['-o', 'ControlMaster=no', '-o',
+            'ControlPath={0}'.format(_control_path())]
+
+def ssh_command(machine, cmd = [], opts = []):
+    """ Return ssh command (list) that runs cmd on the machine """
+    return [_ssh_cmd()] + ssh_options() + opts + \
+           [ssh_destination(machine)] + cmd
+
+def _close_master_connections():
+    global _control_dir
+
+    for dest in _masters:
+        dbg('Closing ssh connection to {0}'.format(dest))
+        subprocess.call([_ssh_cmd(), '-o',
+                         'ControlPath={0}'.format(_control_path()),
+                         '-O', 'exit', dest],
+                        stdout = open(os.devnull, 'w'),
+                        stderr = subprocess.STDOUT)
+
+    shutil.rmtree(_control_dir, ignore_errors = True)
+    _control_dir = None
+
+def open_master_connections(tasks):
+    """
+    Open master connection to every machine. Machines that
+    we can not connect to are removed from tasks.
+    Return True if there is any machine left.
+    """
+    global _control_dir
+    global _ssh
+
+    if configs['ssh-master'] != 'yes' or not configs.has_key('ssh-cmd'):
+        return len(tasks) > 0
+
+    _ssh = configs['ssh-cmd']
+    _control_dir = tempfile.mkdtemp(prefix = 'satt-ssh-')
+    atexit.register(_close_master_connections)
+
+    procs = list()
+    # open them parallely, -f makes ssh go into background
+    # once the connection is established. The background ssh keeps
+    # its output open, so we can not use pipes here
+    for t in tasks:
+        dest = ssh_destination(t.getMachine())
+        out = tempfile.TemporaryFile()
+        p = subprocess.Popen([_ssh_cmd(), '-o', 'ControlMaster=yes',
+                              '-o', 'ControlPath={0}'.format(_control_path()),
+                              '-o', 'ControlPersist=yes',
+                              '-o', 'BatchMode=yes',
+                              '-o', 'ConnectTimeout=10',
+                              '-N', '-f', dest],
+                             stdout = out, stderr = subprocess.STDOUT)
+        procs.append((p, t, dest, out))
+
+    for p, t, dest, out in procs:
+        p.wait()
+
+        if p.returncode != 0:
+            out.seek(0)
+            satt_log(colored('WARN: Failed connecting to {0}, removing it: {1}'
+                             .format(t.getMachine(), out.read().strip()), 'red'))
+            tasks.remove(t)
+        else:
+            dbg('Opened ssh connection to {0}'.format(dest))
+            _masters.append(dest)
+
+        out.close()
+
+    # make the {ssh-cmd} in cmd and sync-cmd use the connections
+    # and export it for the sync scripts (rsync takes RSYNC_RSH)
+    sshcmd = ' '.join([_ssh_cmd()] + ssh_options())
+    configs['ssh-cmd'] = sshcmd
+    os.environ['SATT_SSH'] = sshcmd
+    os.environ['RSYNC_RSH'] = sshcmd
+
+    return len(tasks) > 0
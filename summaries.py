@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+
+# Summaries of results in the run_summaries table: number of results,
+# sums of points, cpu time and memory for every run, tool, category,
+# result, correctness and witness. The db writer updates them
+# in the transaction that stores the results, so the e-mail after
+# the run and db-cli stats read a few rows instead of all results.
+# Results that are stored or deleted in another way (db-cli import,
+# DELETE FROM task_results) need rebuild() (./db-cli summarize).
+
+KEY = ['run_id', 'tool_id', 'category_id', 'result', 'is_correct', 'witness']
+SUMS = ['num_results', 'points', 'cpu_time', 'memory_usage']
+
+# the same as in database/migrations/003_run_summaries.sql
+REBUILD_QUERY = """
+        INSERT INTO run_summaries
+        (run_id, tool_id, category_id, result, is_correct, witness,
+         num_results, points, cpu_time, memory_usage)
+        SELECT run_id, tool_id, category_id, result, is_correct, witness,
+               count(*), IFNULL(SUM(points), 0), IFNULL(SUM(cpu_time), 0),
+               IFNULL(SUM(memory_usage), 0)
+        FROM task_results INNER JOIN tasks ON task_id = tasks.id
+        {0}
+        GROUP BY run_id, tool_id, category_id, result, is_correct, witness;
+        """
+
+def summarize(items):
+    """
+    Return rows (KEY + SUMS values) for the items of the db writer,
+    (row of task_results, tool_id, task_id, benchmark, category_id)
+    """
+    sums = dict()
+    for row, tool_id, task_id, rb, cat_id in items:
+        # see INSERT_RESULT in dbwriter.py
+        key = (row[10], tool_id, cat_id, row[2], row[4], row[3])
+        vals = sums.setdefault(key, [0, 0, 0, 0])
+        vals[0] += 1
+        vals[1] += row[5] or 0
+        vals[2] += row[6] or 0
+        vals[3] += row[7] or 0
+
+    return [k + tuple(v) for k, v in sums.items()]
+
+def store_summaries(db, items):
+    """ Add the items of the db writer to the summaries (not commited) """
+    rows = summarize(items)
+    if rows:
+        db.accumulate('run_summaries', KEY, SUMS, rows)
+
+def rebuild(db, tool_id = None):
+    """ Compute the summaries (of the tool) again from the results """
+    if tool_id is None:
+        db.execute('DELETE FROM run_summaries;')
+        db.execute(REBUILD_QUERY.format(''))
+    else:
+        db.execute('DELETE FROM run_summaries WHERE tool_id = %s;', [tool_id])
+        db.execute(REBUILD_QUERY.format('WHERE tool_id = %s'), [tool_id])
@@ -4,6 +4,9 @@
 
 set -e
 
+# satt exports SATT_SSH (and RSYNC_RSH) that reuse its connection
+SSH="${SATT_SSH:-ssh}"
+
 sendfile()
 {
 	FILE="$1"
@@ -17,6 +20,6 @@ SYMBIOTIC_DIR="$3"
 sendfile symbiotic/run_benchmark
 sendfile symbiotic/copy_symbiotic.py
 
-ssh "$MACHINE" "$REMOTE_DIR/satt/symbiotic/copy_symbiotic.py" "$SYMBIOTIC_DIR"
+$SSH "$MACHINE" "$REMOTE_DIR/satt/symbiotic/copy_symbiotic.py" "$SYMBIOTIC_DIR"
 
 exit 0
@@ -34,6 +34,7 @@ from dispatcher import Dispatcher
 from configs import configs
 from reporter import BenchmarkReport
 from log import satt_log
+from ssh import ssh_command
 
 class SyncReporter(BenchmarkReport):
     def __init__(self, tasks):
@@ -43,7 +44,8 @@ class SyncReporter(BenchmarkReport):
         mach = rb.task.getMachine()
         name = rb.name
 
-        rb.proc.poll()
+        # the output is closed, but the process may not have exited yet
+        rb.proc.wait()
         if rb.proc.returncode != 0:
             msg = '{0} {1} - {2}: FAILED (removing)'.format(rb.category, mach, name)
             satt_log(colored('{0}'.format(msg), 'red'))
@@ -64,17 +66,25 @@ class SyncReporter(BenchmarkReport):
 
 class SyncDispatcher(Dispatcher):
     def __init__(self, tasks):
-        Dispatcher.__init__(self, tasks, SyncReporter(tasks))
+        Dispatcher.__init__(self, tasks, report = SyncReporter(tasks))
+
+        # synchronizing is not a benchmark, it has no result and it
+        # can take long, so do not run copies of it nor kill it
+        self._speculate = False
+        self._time_limit = None
+
+        # we do not use the queue, every machine
+        # must be synchronized exactly once
+        self._unsynced = list(tasks)
+        self._benchmarks_count = len(tasks)
 
         # create remote directory if it does not exists
         # this create remote-dir and remote-dir/satt
         for t in tasks:
-            m = '{0}@{1}'.format(configs['ssh-user'], t.getMachine())
-
             dbg('Creating remote directory on {0}'.format(t.getMachine()))
-            subprocess.call(['ssh', m,
-                            'mkdir', '-p',
-                            '{0}/satt'.format(configs['remote-dir'])])
+            subprocess.call(ssh_command(t.getMachine(),
+                                        ['mkdir', '-p',
+                                         '{0}/satt'.format(configs['remote-dir'])]))
 
             # also we need synchronize benchmarks on remote directory,
             # so call sync-benchmarks.sh for this machine
@@ -92,19 +102,20 @@ class SyncDispatcher(Dispatcher):
 
     # do the same as dispatcher, but run sync-cmd instead of cmd
     def _runBenchmark(self, task):
-        bench = task.runBenchmark(configs['sync-cmd'])
-        if bench is None:
+        if not task in self._unsynced:
             return None
 
+        self._unsynced.remove(task)
+        bench = task.runBenchmark(configs['sync-cmd'],
+                                  (configs['tool'], 'synchronizing'))
+
         self._registerBenchmark(bench)
 
         return bench
 
-def add_tasks(tasks):
-    for t in tasks:
-        # we need to add at least one path so that
-        # the dispatcher can dispatch something.
-        t.add((configs['tool'], 'synchronizing'))
+    # there are no copies and no result, every machine must be reported
+    def _benchmarkFinished(self, bench):
+        self._benchmarkDone(bench)
 
 def rsync_tool_runner(tasks):
     satt_log('Synchronizing...')
@@ -113,8 +124,6 @@ def rsync_tool_runner(tasks):
         dbg('No sync command')
         return
 
-    add_tasks(tasks)
-
     d = SyncDispatcher(tasks)
     d.run()
 
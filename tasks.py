@@ -36,10 +36,16 @@ import glob
 import atexit
 import getopt
 import re
+import heapq
+import time
 
-from common import err, dbg, expand
+from common import err, dbg, expand, colored
+from ssh import ssh_command
 import configs
 
+# every command that uses {pidfile} gets its own file
+_pidfile_num = 0
+
 def expandVariables(cmd):
     c = cmd[:]
     for key, val in configs.configs.items():
@@ -52,10 +58,33 @@ def expandVariables(cmd):
 
     return c
 
+def new_pidfile(cmd):
+    """ Return the file that {pidfile} in cmd expands to (or None) """
+    global _pidfile_num
+
+    if not '{pidfile}' in cmd:
+        return None
+
+    _pidfile_num += 1
+    return '/tmp/satt-{0}-{1}.pid'.format(configs.configs['run-id'],
+                                          _pidfile_num)
+
+def kill_script(pidfile):
+    """
+    Return shell script that kills the process group written in pidfile
+    and prints how many processes it had
+    """
+    return '{{ read pg < {0}; }} 2>/dev/null; rm -f {0}; '\
+           'if [ -z "$pg" ]; then echo 0; exit 0; fi; '\
+           'pgrep -g $pg | wc -l; '\
+           'kill -TERM -$pg 2>/dev/null; sleep 1; '\
+           'kill -KILL -$pg 2>/dev/null; exit 0'.format(pidfile)
+
 class Task(object):
     """
-    Class representing a task running on a remote computer
-    The task is a set of benchmarks.
+    Class representing a remote computer that runs benchmarks.
+    The benchmarks are taken from a BenchmarkQueue shared
+    by all tasks.
     """
     BUFSIZE = 1024
 
@@ -68,29 +97,18 @@ class Task(object):
                         parallely
         """
         self._machine = mach
-        self._benchmarks = []
         self._parallel_no = parallel_no
-        self._count = 0
 
     def getParallel(self):
         return self._parallel_no
 
+    def setParallel(self, parallel_no):
+        self._parallel_no = parallel_no
+
     def getMachine(self):
         return self._machine
 
-    def getCount(self):
-        return len(self._benchmarks)
-
-    def add(self, test):
-        """ Add new test to the task """
-        self._benchmarks.append(test)
-        self._count += 1
-
-    def readd(self, rb):
-        """ Add benchmark that already ran """
-        self.add((rb.name, rb.category))
-
-    def expandSpecialVariables(self, cmd, name, cat):
+    def expandSpecialVariables(self, cmd, name, cat, pidfile = None):
         # expand {params}
         par = configs.configs['params']
         if par.has_key(cat):
@@ -113,35 +131,217 @@ class Task(object):
         # expand explicit name of category
         ecmd = ecmd.replace('{category}', cat)
 
+        # where the command writes its process group
+        if pidfile:
+            ecmd = ecmd.replace('{pidfile}', pidfile)
+
         return ecmd
 
-    def runBenchmark(self, cmd):
+    def _run(self, ecmd, preexec_fn = None):
+        ecmd = expandVariables(ecmd)
+        dbg('running: {0}'.format(ecmd))
+
+        def setup():
+            # the command gets its own process group, so that
+            # we can kill all its processes (see RunningTask.kill)
+            os.setpgrp()
+            if preexec_fn:
+                preexec_fn()
+
+        # the command is not in the foreground process group, reading
+        # the terminal would stop it (SIGTTIN), so it gets no input
+        devnull = open(os.devnull, 'r')
+        try:
+            return subprocess.Popen(ecmd, Task.BUFSIZE, shell = True,
+                                    stdin = devnull,
+                                    stdout = subprocess.PIPE,
+                                    stderr = subprocess.STDOUT,
+                                    preexec_fn = setup)
+        finally:
+            devnull.close()
+
+    def runBenchmark(self, cmd, bench):
         """
         Run one benchmark.
 
         This includes creating ssh connection to the remote machine
-        and running one benchmark. It will remove the benchmark from
-        the benchmark list.
+        and running one benchmark (a pair of name and category).
         """
 
         from dispatcher import RunningTask
 
-        # nothing to run
+        name, cat = bench
+        pidfile = new_pidfile(cmd)
+
+        p = self._run(self.expandSpecialVariables(cmd, name, cat, pidfile))
+
+        rb = RunningTask(cmd, p, self, name, cat)
+        rb.pidfile = pidfile
+
+        return rb
+
+    def runBatch(self, cmd, benches):
+        """
+        Run more benchmarks from the same category by one command.
+        {benchmark} expands to the list of the benchmarks separated
+        by space and the command is supposed to tag the output
+        of each benchmark (see RunningBatch)
+        """
+
+        from dispatcher import RunningBatch
+
+        names = [b[0] for b in benches]
+        cat = benches[0][1]
+        pidfile = new_pidfile(cmd)
+
+        p = self._run(self.expandSpecialVariables(cmd, ' '.join(names),
+                                                  cat, pidfile))
+
+        rb = RunningBatch(cmd, p, self, names, cat)
+        rb.pidfile = pidfile
+
+        return rb
+
+    def killProcesses(self, pidfile):
+        """
+        Kill processes of the command that wrote pidfile on the machine.
+        Return the process that does it, it prints the number
+        of killed processes
+        """
+        return subprocess.Popen(ssh_command(self._machine,
+                                            [kill_script(pidfile)]),
+                                stdout = subprocess.PIPE,
+                                stderr = subprocess.STDOUT)
+
+class BenchmarkQueue(object):
+    """
+    Benchmarks that wait for running. The queue is shared by all
+    tasks, so that a machine that has a free slot takes the next
+    benchmark no matter how fast the other machines are.
+
+    Benchmarks that failed are put back after a delay and they
+    are preferably given to a machine they did not fail on.
+    """
+
+    def __init__(self):
+        self._benchmarks = []
+        # (time, benchmark) - benchmarks that wait for another try
+        self._delayed = []
+        # benchmark -> [(machine, time)] of failed attempts
+        self._failures = dict()
+
+    def getCount(self):
+        return len(self._benchmarks) + len(self._delayed)
+
+    def empty(self):
+        return not self._benchmarks and not self._delayed
+
+    def add(self, bench):
+        """ Add new benchmark (a pair of name and category) """
+        self._benchmarks.append(bench)
+
+    def readd(self, rb, delay = 0):
+        """ Add benchmark that already ran, run it after delay seconds """
+        bench = (rb.name, rb.category)
+
+        if delay > 0:
+            self._delayed.append((time.time() + delay, bench))
+        else:
+            self.add(bench)
+
+    def recordFailure(self, rb):
+        """ Remember failed attempt, return the number of failed attempts """
+        bench = (rb.name, rb.category)
+        attempts = self._failures.setdefault(bench, [])
+        attempts.append((rb.task.getMachine(), time.strftime('%H:%M:%S')))
+
+        return len(attempts)
+
+    def attempts(self, rb):
+        """ Return the number of failed attempts of the benchmark """
+        return len(self._failures.get((rb.name, rb.category), []))
+
+    def history(self, rb):
+        """ Return description of failed attempts of the benchmark """
+        attempts = self._failures.get((rb.name, rb.category), [])
+
+        return 'Failed attempts: {0}\n'.format(
+                ', '.join(['{0} ({1})'.format(m, t) for (m, t) in attempts]))
+
+    def _release(self):
+        """ Move benchmarks that waited long enough back to the queue """
+        if not self._delayed:
+            return
+
+        now = time.time()
+        waiting = []
+        for t, bench in self._delayed:
+            if t <= now:
+                self.add(bench)
+            else:
+                waiting.append((t, bench))
+
+        self._delayed = waiting
+
+    def _failedOn(self, bench, mach):
+        """ Did the benchmark fail on the machine already? """
+        attempts = self._failures.get(bench)
+        if attempts is None:
+            return False
+
+        return mach in [m for (m, t) in attempts]
+
+    def _choose(self, task):
+        """ Return index of the benchmark that task should run """
+        last = len(self._benchmarks) - 1
+        if task is None or not self._failures:
+            return last
+
+        mach = task.getMachine()
+        for i in xrange(last, -1, -1):
+            if not self._failedOn(self._benchmarks[i], mach):
+                return i
+
+        # it failed everywhere, so take anything
+        return last
+
+    def pop(self, task = None):
+        """ Take next benchmark, return None if there is none """
+        self._release()
+
         if not self._benchmarks:
             return None
 
-        self._count -= 1
-        name, cat = self._benchmarks.pop()
+        return self._benchmarks.pop(self._choose(task))
 
-        ecmd = self.expandSpecialVariables(cmd, name, cat)
-        ecmd = expandVariables(ecmd)
-        dbg('running: {0}'.format(ecmd))
+    def popBatch(self, num, task = None):
+        """ Take at most num next benchmarks from the same category """
+        first = self.pop(task)
+        if first is None:
+            return []
 
-        p = subprocess.Popen(ecmd, Task.BUFSIZE, shell = True,
-                             stdout = subprocess.PIPE,
-                             stderr = subprocess.STDOUT)
+        batch = [first]
+        i = len(self._benchmarks) - 1
+        while i >= 0 and len(batch) < num:
+            bench = self._benchmarks[i]
+            if bench[1] != first[1]:
+                break
 
-        return RunningTask(cmd, p, self, name, cat)
+            # leave it for other machine
+            if task is None or not self._failedOn(bench, task.getMachine()):
+                batch.append(self._benchmarks.pop(i))
+
+            i -= 1
+
+        return batch
+
+    def sortBy(self, key):
+        """ Reorder the queue so that benchmarks with greatest key go first """
+        # we pop from the end of the list
+        self._benchmarks.sort(key = key)
+
+    def getBenchmarks(self):
+        return self._benchmarks
 
 def get_machines():
     path = configs.configs['machines']
@@ -179,7 +379,7 @@ def get_machines():
 
     return tasks
 
-def assign_set(dirpath, path, tasks, should_skip):
+def assign_set(dirpath, path, queue, should_skip):
     old_dir = os.getcwd()
     epath = expand(dirpath)
     os.chdir(epath)
@@ -205,23 +405,20 @@ def assign_set(dirpath, path, tasks, should_skip):
         err("Failed opening set of benchmarks ({0}): {1}"
             .format(path, e.strerror))
 
-    num = len(tasks)
-    assert num > 0
-
     cat = path[:-4]
+    n = 0
 
     for line in f:
         line = line.strip()
         if not line:
             continue
 
-        n = 0
         for it in glob.iglob(line):
             bench = ('benchmarks/c/{0}'.format(it), cat)
             if should_skip(bench):
                 dbg('Skipping benchmark {0}'.format(it))
             else:
-                tasks[n % num].add(bench)
+                queue.add(bench)
                 n += 1
 
     f.close()
@@ -229,7 +426,7 @@ def assign_set(dirpath, path, tasks, should_skip):
 
     return n != 0
 
-def assign_set_dir(dirpath, tasks, should_skip):
+def assign_set_dir(dirpath, queue, should_skip):
     edirpath = os.path.expanduser(dirpath)
     dbg('Looking for benchmarks in: {0}'.format(edirpath))
 
@@ -247,24 +444,16 @@ def assign_set_dir(dirpath, tasks, should_skip):
 
         # this path needs to be relative, since it can appear
         # on remote computer
-        gotany |= assign_set(dirpath, f, tasks, should_skip)
+        gotany |= assign_set(dirpath, f, queue, should_skip)
 
     if not gotany:
         sys.stderr.write('Warning: Haven\'t found any .set file\n')
 
-def _should_skip_with_db(dbproxy, toolid, year_id, x):
+def _should_skip_known(known, x):
     name, cat = x
-    catid = dbproxy.getCategoryID(year_id, cat)
-    if catid is None:
-        return False
-
-    taskid = dbproxy.getTaskID(catid, name)
-    if taskid is None:
-        return False
+    return (cat, os.path.basename(name)) in known
 
-    return dbproxy.hasTaskResult(taskid, toolid)
-
-def get_benchmarks(files, tasks):
+def get_benchmarks(files, queue):
     items = files.split(',')
 
     skip_known_id = configs.configs['skip-known-benchmarks']
@@ -281,7 +470,11 @@ def get_benchmarks(files, tasks):
             err('Invalid tool id for skip-known-benchmarks')
 
 	dbg('Will skip benchmarks from tool {0}'.format(toolid))
-        should_skip = lambda x: _should_skip_with_db(dbproxy, toolid, year_id, x)
+
+        # one query instead of a few for every benchmark
+        known = dbproxy.getKnownResults(toolid, year_id)
+        dbg('Tool {0} has results for {1} benchmarks'.format(toolid, len(known)))
+        should_skip = lambda x: _should_skip_known(known, x)
     else:
         should_skip = lambda x: False
 
@@ -295,18 +488,96 @@ def get_benchmarks(files, tasks):
             # get folder or .set file
             if os.path.isdir(path):
                 path = '{0}/c'.format(path)
-                assign_set_dir(path, tasks, should_skip)
+                assign_set_dir(path, queue, should_skip)
             elif os.path.isfile(path):
                 dirpath = os.path.dirname(path)
                 basename = os.path.basename(path)
-                assign_set(dirpath, basename, tasks, should_skip)
+                assign_set(dirpath, basename, queue, should_skip)
 
     # return number of found benchmarks
-    num = 0
-    for t in tasks:
-        num += t.getCount()
+    return queue.getCount()
+
+def _median(vals):
+    vals = sorted(vals)
+    l = len(vals)
+    if l == 0:
+        return None
+
+    if l % 2 == 1:
+        return vals[l / 2]
+    else:
+        return (vals[l / 2 - 1] + vals[l / 2]) / 2.0
 
-    return num
+def predict_makespan(times, slots):
+    """
+    Return how long it takes to run benchmarks with given times
+    when they are started in the given order on 'slots' slots
+    """
+    if slots <= 0:
+        return 0
+
+    free_at = [0.0] * slots
+    for t in times:
+        heapq.heapreplace(free_at, free_at[0] + t)
+
+    return max(free_at)
+
+def schedule_longest_first(queue, tasks):
+    """
+    Reorder the queue so that the benchmarks that ran longest
+    in the previous runs of this tool start first. Benchmarks
+    that we have no history for get the median of their category.
+    """
+    from log import satt_log
+
+    if configs.configs['no-db'] == 'yes':
+        satt_log(colored('WARN: --schedule=longest-first needs the database,'
+                         ' running benchmarks in the default order', 'red'))
+        return
+
+    from database_proxy import DatabaseProxy
+
+    if configs.configs.has_key('tool-tag'):
+        tag = configs.configs['tool-tag']
+    else:
+        tag = configs.configs['tool']
+
+    dbproxy = DatabaseProxy()
+    history = dbproxy.getExpectedTimes(configs.configs['tool'], tag,
+                                       configs.configs['year'])
+    if not history:
+        satt_log('No history for tool {0} in year {1}, not reordering benchmarks'
+                 .format(configs.configs['tool'], configs.configs['year']))
+        return
+
+    bycat = dict()
+    for (cat, name), t in history.items():
+        bycat.setdefault(cat, []).append(t)
+
+    medians = dict()
+    for cat, vals in bycat.items():
+        medians[cat] = _median(vals)
+    default = _median(history.values())
+
+    def expected_time(bench):
+        name, cat = bench
+        t = history.get((cat, os.path.basename(name)))
+        if t is None:
+            t = medians.get(cat, default)
+
+        return t
+
+    queue.sortBy(expected_time)
+
+    # the queue is popped from the end
+    times = [expected_time(b) for b in reversed(queue.getBenchmarks())]
+    slots = sum([t.getParallel() for t in tasks])
+    makespan = int(predict_makespan(times, slots))
+
+    satt_log('Running longest benchmarks first, predicted makespan: '
+             '{0}:{1:02}:{2:02} ({3} slots)'.format(makespan / 3600,
+                                                   (makespan / 60) % 60,
+                                                   makespan % 60, slots))
 
 def git_checkout(repo_dir, tag):
     old_dir = os.getcwd()
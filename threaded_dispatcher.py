@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2014 Marek Chalupa
+# E-mail: statica@fi.muni.cz
+#
+# Permission to use, copy, modify, distribute, and sell this software and its
+# documentation for any purpose is hereby granted without fee, provided that
+# the above copyright notice appear in all copies and that both that copyright
+# notice and this permission notice appear in supporting documentation, and
+# that the name of the copyright holders not be used in advertising or
+# publicity pertaining to distribution of the software without specific,
+# written prior permission. The copyright holders make no representations
+# about the suitability of this software for any purpose. It is provided "as
+# is" without express or implied warranty.
+#
+# THE COPYRIGHT HOLDERS DISCLAIM ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN NO
+# EVENT SHALL THE COPYRIGHT HOLDERS BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS OF USE,
+# DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT, NEGLIGENCE OR OTHER
+# TORTIOUS ACTION, ARISING OUT OF OR IN CONNECTION WITH THE USE OR PERFORMANCE
+# OF THIS SOFTWARE.
+#
+# On arran we have only python2, so use python2
+
+# Dispatcher that reads the output of every benchmark in its own thread
+# and calls reporter's done() in a separate worker thread, so that
+# a slow database does not stop reading the output of running benchmarks.
+# All the events are passed to the main thread via one queue, so the
+# dispatcher's state is touched only from the main thread. The other way,
+# the reporter is used only from the worker thread.
+
+import sys
+import os
+import time
+import threading
+import Queue
+
+from common import err, dbg
+from dispatcher import Dispatcher, RunningTask
+
+class ReportWorker(threading.Thread):
+    """ Call reporter's done() for finished benchmarks """
+
+    def __init__(self, report, events):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self._report = report
+        self._events = events
+        self._jobs = Queue.Queue()
+        self._flushed = threading.Event()
+
+        # what reporter's backlogged() said after the last job,
+        # the main thread reads it
+        self.backlogged = False
+
+    def submit(self, bench):
+        self._jobs.put(('done', bench))
+
+    def progress(self, progress):
+        self._jobs.put(('progress', progress))
+
+    def flush(self):
+        """ Make the reporter store all results, wait until it is done """
+        if not self.is_alive():
+            self._report.flush()
+            return
+
+        self._flushed.clear()
+        self._jobs.put(('flush', None))
+        # wait() without timeout can not be interrupted
+        while self.is_alive() and not self._flushed.wait(1):
+            pass
+
+    def stop(self):
+        self._jobs.put(('stop', None))
+        self.join()
+
+    def run(self):
+        while True:
+            # wake up once in a while to let
+            # the reporter store the results it holds
+            try:
+                job, arg = self._jobs.get(timeout = 1)
+            except Queue.Empty:
+                job, arg = ('tick', None)
+
+            try:
+                if job == 'stop':
+                    return
+                elif job == 'tick':
+                    self._report.tick()
+                elif job == 'progress':
+                    self._report.progress(arg)
+                elif job == 'flush':
+                    self._report.flush()
+                    self._flushed.set()
+                else:
+                    ok = self._report.done(arg)
+
+                self.backlogged = self._report.backlogged()
+            # err() calls sys.exit() that would end only this thread
+            except BaseException:
+                self._events.put(('exception', arg, sys.exc_info()))
+                return
+
+            if job == 'done':
+                self._events.put(('reported', arg, ok))
+
+def _read_output(bench, events):
+    fd = bench.proc.stdout.fileno()
+    while True:
+        data = os.read(fd, RunningTask.CHUNK_SIZE)
+        lines = bench.feed(data)
+        if lines:
+            events.put(('lines', bench, lines))
+
+        if not data:
+            break
+
+    bench.wait()
+    events.put(('eof', bench, None))
+
+class ThreadedDispatcher(Dispatcher):
+    """ Dispatcher that does not block reading the output on reporter """
+
+    def __init__(self, tasks = [], queue = None, report = None):
+        Dispatcher.__init__(self, tasks, queue, report)
+
+        self._events = Queue.Queue()
+        self._worker = ReportWorker(self._report, self._events)
+        self._worker.start()
+
+        self._benchs = set()
+        # benchmarks that wait for the reporter
+        self._reporting = 0
+        self._last_maintain = 0
+
+    def _registerBenchmark(self, bench):
+        """ Start reading the output of the benchmark """
+
+        self._benchs.add(bench)
+        self._running[bench.task] = self._running.get(bench.task, 0) + 1
+
+        t = threading.Thread(target = _read_output,
+                             args = (bench, self._events))
+        t.daemon = True
+        t.start()
+
+    def _is_running(self):
+        return self._benchs or self._reporting > 0
+
+    def _runningBenchmarks(self):
+        return self._benchs
+
+    def _dropBenchmark(self, bench):
+        # the reader thread gets EOF and waits for the process,
+        # we ignore what it sends from now on
+        self._benchs.remove(bench)
+        self._running[bench.task] -= 1
+
+        self._addKiller(bench, bench.kill())
+
+    def _tickReport(self):
+        # the worker does it, the reporter is used only from it
+        pass
+
+    def _flushReport(self):
+        # this is the end of the run, the worker would wake up
+        # while python is shutting down
+        self._worker.flush()
+        if self._worker.is_alive():
+            self._worker.stop()
+
+    def _progressReport(self, progress):
+        self._worker.progress(progress)
+
+    def _isReportBacklogged(self):
+        return self._worker.backlogged
+
+    def _killTasks(self):
+        for bench in self._benchs:
+            self._addKiller(bench, bench.kill())
+
+        self._collectKillers(True)
+
+    def _benchmarkDone(self, bench):
+        self._reporting += 1
+        self._worker.submit(bench)
+
+    def _wait_event(self):
+        # Queue.get() without timeout can not be
+        # interrupted by KeyboardInterrupt. Also we need to wake up
+        # once in a while to run benchmarks that waited for another try
+        try:
+            return self._events.get(timeout = 1)
+        except Queue.Empty:
+            return (None, None, None)
+
+    def _monitorTasks(self):
+        assert self._has_work()
+
+        while self._has_work():
+            # the events may keep coming, but we want
+            # to look at the machines once in a while anyway
+            if time.time() - self._last_maintain >= 1:
+                self._maintain()
+                self._last_maintain = time.time()
+
+            ev, bench, data = self._wait_event()
+
+            if ev is None:
+                # timeout, _maintain() is called on the next iteration
+                continue
+            elif ev in ['lines', 'eof'] and not bench in self._benchs:
+                # the benchmark was dropped
+                continue
+            elif ev == 'lines':
+                for line in data:
+                    self._report.report(line, bench)
+
+                # benchmarks from a batch are done
+                # before the whole batch
+                for rb in bench.takeFinished():
+                    self._benchmarkDone(rb)
+            elif ev == 'eof':
+                self._benchs.remove(bench)
+                self._running[bench.task] -= 1
+
+                for rb in bench.finish():
+                    self._benchmarkFinished(rb)
+
+                # the slot on this machine is free now
+                self._fillSlots()
+            elif ev == 'reported':
+                self._reporting -= 1
+                self._benchmarkReported(bench, data)
+
+                # the benchmark may have been queued again
+                self._fillSlots()
+            elif ev == 'exception':
+                self._killTasks()
+                raise data[0], data[1], data[2]
+            else:
+                err('Unknown event: {0}'.format(ev))
+
+        dbg('[local] All benchmarks done')